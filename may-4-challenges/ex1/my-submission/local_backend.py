@@ -0,0 +1,352 @@
+"""An in-process backend with the provider/backend/job interface of the
+notebooks, for running the ex2 and ex3 pipelines offline.  Those notebooks
+import it as ``from offline import LocalProvider`` through the shared
+``may-4-challenges/offline.py``, which loads it from here by file path.
+
+    provider = LocalProvider()
+    backend = least_busy(provider.backends(filters=lambda x: x.configuration().n_qubits >= 5
+                                           and not x.configuration().simulator))
+    job = backend.run(circuits, shots=8192)      # or backend.run(assemble(...))
+    counts = job.result().get_counts(0)
+
+Each backend owns an asyncio loop on a background thread.  ``run`` only puts
+the job on the loop's queue.  A batcher coroutine collects everything
+submitted within ``batch_window`` seconds (up to ``max_batch`` circuits), so
+the 100 single-shot BB84 jobs run as one batch.  Identical circuits in a
+batch are simulated once, on a thread pool, with ``measured_distribution``
+from ``sampling``.  Each experiment then draws its shots from that
+distribution.  An optional ``ReadoutNoise`` flips measured bits with
+per-qubit probabilities, like the calibration matrices of a device.
+
+Only circuits whose measurements are all at the end are supported; any
+other circuit fails its job with ``JobError``.
+"""
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+
+from sampling import format_counts_key, measured_distribution, terminal_measurements
+
+try:
+    from qiskit.providers import JobStatus
+except ImportError:  # keep the module usable without qiskit's provider API
+    import enum
+
+    class JobStatus(enum.Enum):
+        INITIALIZING = 'job is being initialized'
+        QUEUED = 'job is queued'
+        RUNNING = 'job is actively running'
+        CANCELLED = 'job has been cancelled'
+        DONE = 'job has successfully run'
+        ERROR = 'job incurred error'
+
+
+class JobError(Exception):
+    pass
+
+
+class ReadoutNoise:
+    """Independent readout errors: ``p01`` is P(read 1 | 0) and ``p10`` is
+    P(read 0 | 1), each a scalar or a per-qubit sequence."""
+
+    def __init__(self, p01=0.02, p10=0.05):
+        self.p01 = p01
+        self.p10 = p10
+
+    def matrix(self, qubit):
+        """``M[measured, prepared]`` for ``qubit``."""
+        a = self.p01 if np.isscalar(self.p01) else self.p01[qubit]
+        b = self.p10 if np.isscalar(self.p10) else self.p10[qubit]
+        return np.array([[1 - a, b], [a, 1 - b]])
+
+    def apply(self, probs, qubits):
+        """Noisy distribution over outcomes whose bit ``j`` is ``qubits[j]``."""
+        k = len(qubits)
+        tensor = probs.reshape((2,) * k)
+        for j, q in enumerate(qubits):
+            axis = k - 1 - j
+            tensor = np.moveaxis(np.tensordot(self.matrix(q), tensor, axes=(1, axis)), 0, axis)
+        return tensor.reshape(-1)
+
+
+def _param_key(p):
+    try:
+        return float(p)
+    except (TypeError, ValueError):
+        return np.asarray(p).tobytes() if hasattr(p, 'shape') else repr(p)
+
+
+def circuit_key(qc):
+    """A hashable key that is equal for circuits with the same gates on the
+    same bits, whatever their names."""
+    ops = tuple((instr.name, tuple(_param_key(p) for p in instr.params),
+                 tuple(qc.qubits.index(q) for q in qargs), tuple(qc.clbits.index(c) for c in cargs))
+                for instr, qargs, cargs in qc.data)
+    return qc.num_qubits, tuple(len(r) for r in qc.cregs), ops
+
+
+class LocalResult:
+    """The parts of ``qiskit.result.Result`` the notebooks use."""
+
+    def __init__(self, backend_name, job_id, names, counts, shots, time_taken):
+        self.backend_name = backend_name
+        self.job_id = job_id
+        self.names = names
+        self.counts = counts
+        self.shots = shots
+        self.time_taken = time_taken
+        self.success = True
+
+    def get_counts(self, experiment=None):
+        """Counts of one experiment, by index, name or circuit; all of them
+        as a list when there are several and none is named."""
+        if experiment is None:
+            return self.counts[0] if len(self.counts) == 1 else list(self.counts)
+        if isinstance(experiment, int):
+            return self.counts[experiment]
+        name = experiment if isinstance(experiment, str) else experiment.name
+        try:
+            return self.counts[self.names.index(name)]
+        except ValueError:
+            raise JobError('no experiment named %r' % name) from None
+
+
+class LocalJob:
+
+    def __init__(self, backend, circuits, shots, seed):
+        self.backend = backend
+        self.circuits = circuits
+        self.shots = shots
+        self.seed = seed
+        self._job_id = uuid.uuid4().hex
+        self._status = JobStatus.QUEUED
+        self._result = None
+        self._error = None
+        self._done = threading.Event()
+        self.submitted = time.perf_counter()
+
+    def job_id(self):
+        return self._job_id
+
+    def status(self):
+        return self._status
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise JobError('job %s timed out' % self._job_id)
+
+    def result(self, timeout=None):
+        self.wait(timeout)
+        if self._error is not None:
+            raise JobError('job %s failed: %s' % (self._job_id, self._error))
+        return self._result
+
+    def _finish(self, result=None, error=None):
+        self._result, self._error = result, error
+        self._status = JobStatus.ERROR if error is not None else JobStatus.DONE
+        self._done.set()
+
+
+class _Scheduler:
+    """The asyncio side of a backend: a queue, a batcher and a worker pool."""
+
+    def __init__(self, backend, max_workers, batch_window, max_batch):
+        self.backend = backend
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='local-backend')
+        self.stats = {'jobs': 0, 'batches': 0, 'circuits': 0, 'simulated': 0}
+        self.pending = 0
+        self._loop = None
+        self._tasks = set()       # asyncio keeps only weak references to tasks
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def main():
+                asyncio.set_event_loop(loop)
+                self._queue = asyncio.Queue()
+                self._tasks.add(loop.create_task(self._batcher()))
+                ready.set()
+                loop.run_forever()
+
+            threading.Thread(target=main, name='local-backend-loop', daemon=True).start()
+            ready.wait()
+            self._loop = loop
+
+    def submit(self, job):
+        self._start()
+        with self._lock:
+            self.pending += 1
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, job)
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0].circuits)
+            deadline = loop.time() + self.batch_window
+            while size < self.max_batch:
+                try:
+                    job = await asyncio.wait_for(self._queue.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+                batch.append(job)
+                size += len(job.circuits)
+            task = loop.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        loop = asyncio.get_running_loop()
+        for job in batch:
+            job._status = JobStatus.RUNNING
+        unique = {}
+        for job in batch:
+            job.keys = [circuit_key(qc) for qc in job.circuits]
+            for key, qc in zip(job.keys, job.circuits):
+                unique.setdefault(key, qc)
+        keys = list(unique)
+        dists = await asyncio.gather(*(loop.run_in_executor(self.executor, self.backend._distribution,
+                                                            unique[k]) for k in keys),
+                                     return_exceptions=True)
+        dists = dict(zip(keys, dists))
+        self.stats['jobs'] += len(batch)
+        self.stats['batches'] += 1
+        self.stats['circuits'] += sum(len(job.circuits) for job in batch)
+        self.stats['simulated'] += len(keys)
+        done = await asyncio.gather(*(loop.run_in_executor(self.executor, self.backend._sample, job, dists)
+                                      for job in batch), return_exceptions=True)
+        for job, outcome in zip(batch, done):
+            if isinstance(outcome, BaseException) and not job.done():
+                job._finish(error=outcome)
+        with self._lock:
+            self.pending -= len(batch)
+
+    def close(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        self.executor.shutdown(wait=False)
+
+
+class LocalBackend:
+    """A simulated device.  ``simulator=False`` by default, so the
+    notebooks' ``least_busy`` filters, which skip simulators, select it."""
+
+    def __init__(self, name='local_device', n_qubits=5, noise=None, simulator=False,
+                 max_workers=None, batch_window=0.005, max_batch=4096, max_shots=8192):
+        self._name = name
+        self.noise = noise
+        self._configuration = SimpleNamespace(backend_name=name, n_qubits=n_qubits, simulator=simulator,
+                                              local=True, max_shots=max_shots,
+                                              basis_gates=['u1', 'u2', 'u3', 'cx', 'id'])
+        self._scheduler = _Scheduler(self, max_workers, batch_window, max_batch)
+
+    def name(self):
+        return self._name
+
+    def configuration(self):
+        return self._configuration
+
+    def status(self):
+        return SimpleNamespace(backend_name=self._name, operational=True,
+                               pending_jobs=self._scheduler.pending, status_msg='active')
+
+    @property
+    def stats(self):
+        """Jobs, batches, circuits and distinct circuits simulated so far."""
+        return dict(self._scheduler.stats)
+
+    def run(self, circuits, shots=1024, seed_simulator=None, **options):
+        """Submit a circuit, a list of circuits or an assembled qobj and
+        return a ``LocalJob`` at once."""
+        if hasattr(circuits, 'experiments'):
+            try:
+                from qiskit.assembler import disassemble
+            except ImportError:
+                raise JobError('this qiskit cannot disassemble a qobj; pass the circuits '
+                               'instead') from None
+            circuits, run_config, _ = disassemble(circuits)
+            shots = run_config.get('shots', shots)
+            seed_simulator = run_config.get('seed_simulator', seed_simulator)
+        if not isinstance(circuits, (list, tuple)):
+            circuits = [circuits]
+        if shots > self._configuration.max_shots:
+            raise JobError('%d shots requested, at most %d allowed' % (shots, self._configuration.max_shots))
+        if seed_simulator is None:
+            seed_simulator = np.random.SeedSequence().entropy
+        job = LocalJob(self, list(circuits), shots, seed_simulator)
+        self._scheduler.submit(job)
+        return job
+
+    def _distribution(self, qc):
+        if terminal_measurements(qc) is None:
+            raise JobError("circuit '%s' has non-terminal measurements" % qc.name)
+        return measured_distribution(qc, self.noise)
+
+    def _sample(self, job, dists):
+        errors = [dists[k] for k in job.keys if isinstance(dists[k], BaseException)]
+        if errors:
+            job._finish(error=errors[0])
+            return
+        rng = np.random.default_rng(job.seed)
+        counts = []
+        for qc, key in zip(job.circuits, job.keys):
+            outcomes, probs = dists[key]
+            hist = rng.multinomial(job.shots, probs)
+            counts.append({format_counts_key(int(outcomes[i]), qc): int(hist[i])
+                           for i in np.flatnonzero(hist)})
+        job._finish(LocalResult(self._name, job.job_id(), [qc.name for qc in job.circuits], counts,
+                                job.shots, time.perf_counter() - job.submitted))
+
+    def close(self):
+        self._scheduler.close()
+
+
+class LocalProvider:
+    """Stands in for ``IBMQ.load_account()``: a noisy 5-qubit device and a
+    noiseless simulator by default."""
+
+    def __init__(self, backends=None):
+        if backends is None:
+            backends = [LocalBackend('local_device', 5, noise=ReadoutNoise()),
+                        LocalBackend('local_qasm_simulator', 32, simulator=True)]
+        self._backends = list(backends)
+
+    def backends(self, name=None, filters=None, **kwargs):
+        found = []
+        for backend in self._backends:
+            if name is not None and backend.name() != name:
+                continue
+            if any(getattr(backend.configuration(), k, None) != v for k, v in kwargs.items()):
+                continue
+            if filters is not None and not filters(backend):
+                continue
+            found.append(backend)
+        return found
+
+    def get_backend(self, name):
+        found = self.backends(name)
+        if not found:
+            raise JobError('no backend named %r' % name)
+        return found[0]
+
+
+def least_busy(backends):
+    """The backend with the fewest pending jobs."""
+    if not backends:
+        raise JobError('no backends to choose from')
+    return min(backends, key=lambda b: b.status().pending_jobs)
@@ -0,0 +1,114 @@
+"""Shot sampling from a single statevector pass.
+
+When every measurement comes at the end of the circuit, the outcome
+distribution is fixed by one statevector: the probabilities are computed
+once, marginalised onto the measured qubits and all shots are drawn with a
+single multinomial draw.  Counts are built from that integer histogram, so
+the work is O(gates + outcomes) instead of O(shots x gates), and only
+outcomes that occurred are turned into bitstrings.
+
+``run_circuit(qc)`` is a drop-in for the notebook helper and falls back to
+the qasm simulator for circuits with mid-circuit measurements, resets,
+classically conditioned gates or gates the tensor engine does not know.
+"""
+import numpy as np
+
+from statevector import simulate
+
+
+def terminal_measurements(qc):
+    """``[(qubit, clbit), ...]`` in clbit order if all measurements are
+    terminal, else ``None``.  A clbit written twice keeps the last
+    measurement, and a qubit may be copied into several clbits."""
+    measured = set()
+    clbits = {}
+    for instr, qargs, cargs in qc.data:
+        qubits = [qc.qubits.index(q) for q in qargs]
+        if instr.name == 'barrier':
+            continue
+        if getattr(instr, 'condition', None) is not None or instr.name == 'reset':
+            return None
+        if instr.name == 'measure':
+            measured.add(qubits[0])
+            clbits[qc.clbits.index(cargs[0])] = qubits[0]
+        elif any(q in measured for q in qubits):
+            return None
+    return [(clbits[c], c) for c in sorted(clbits)]
+
+
+def format_counts_key(clbit_values, qc):
+    """Qiskit count keys: clbit ``k`` is character ``-1 - k`` and registers
+    are separated by spaces."""
+    if len(qc.cregs) <= 1:
+        return '{:0{}b}'.format(clbit_values, qc.num_clbits)
+    parts = []
+    for creg in reversed(qc.cregs):
+        bits = ''.join(str(clbit_values >> qc.clbits.index(b) & 1) for b in reversed(list(creg)))
+        parts.append(bits)
+    return ' '.join(parts)
+
+
+def measured_distribution(qc, noise=None):
+    """``(outcomes, probabilities)``: distinct classical register values as
+    integers and their probabilities, from one statevector pass.
+
+    ``noise`` is an optional readout model with ``apply(probs, qubits)``,
+    applied to the measured qubits before they are copied into clbits.
+    """
+    pairs = terminal_measurements(qc)
+    if pairs is None:
+        raise ValueError('circuit has non-terminal measurements')
+    n = qc.num_qubits
+    probs = np.abs(simulate(qc, skip=('barrier', 'measure'))) ** 2
+    # tensor axis n - 1 - q holds qubit q
+    tensor = probs.reshape((2,) * n) if n else probs
+    qubits = sorted({q for q, _ in pairs})
+    unmeasured = tuple(n - 1 - q for q in range(n) if q not in qubits)
+    marginal = tensor.sum(axis=unmeasured) if unmeasured else tensor
+    # order the remaining axes so that bit j of the flat index is qubits[j]
+    kept = sorted(n - 1 - q for q in qubits)
+    order = [kept.index(n - 1 - q) for q in reversed(qubits)]
+    marginal = np.transpose(marginal, order).reshape(-1)
+    marginal = marginal / marginal.sum()
+    if noise is not None and qubits:
+        marginal = noise.apply(marginal, qubits)
+    index = np.arange(marginal.size)
+    outcomes = np.zeros(marginal.size, dtype=np.int64)
+    for qubit, clbit in pairs:
+        outcomes |= ((index >> qubits.index(qubit)) & 1) << clbit
+    # merge coinciding register values so no probability (or shot) is lost
+    outcomes, inverse = np.unique(outcomes, return_inverse=True)
+    return outcomes, np.bincount(inverse.reshape(-1), weights=marginal, minlength=outcomes.size)
+
+
+def sample_counts(qc, shots=1024, seed=None, memory=False):
+    """Counts dict for ``shots`` runs of a measure-at-end circuit.
+
+    With ``memory=True`` the per-shot bitstrings are returned as well, in a
+    random order, as ``(counts, memory)``.
+    """
+    outcomes, probs = measured_distribution(qc)
+    rng = np.random.default_rng(seed)
+    hist = rng.multinomial(shots, probs)
+    hit = np.flatnonzero(hist)
+    counts = {format_counts_key(int(outcomes[i]), qc): int(hist[i]) for i in hit}
+    if not memory:
+        return counts
+    labels = [format_counts_key(int(outcomes[i]), qc) for i in hit]
+    order = rng.permutation(np.repeat(np.arange(len(hit)), hist[hit]))
+    return counts, [labels[i] for i in order]
+
+
+def run_circuit(qc, shots=1000, seed=None):
+    """Like the notebook's ``run_circuit``, sampling from one statevector
+    pass when the measurements are terminal and every gate is one the
+    tensor engine supports."""
+    if terminal_measurements(qc) is not None:
+        try:
+            return sample_counts(qc, shots, seed)
+        except NotImplementedError:
+            pass
+    from qiskit import Aer, execute
+
+    backend = Aer.get_backend('qasm_simulator')
+    return execute(qc, backend, shots=shots, seed_simulator=seed).result().get_counts()
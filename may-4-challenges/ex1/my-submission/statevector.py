@@ -0,0 +1,295 @@
+"""In-place tensor statevector engine behind ``statevec``.
+
+The state is a ``(batch, 2^n)`` buffer.  A gate on qubit ``q`` views it as
+``(batch, 2^(n-q-1), 2, 2^q)`` (qiskit's little-endian order) and updates
+the two halves in place, chunk by chunk so the temporaries stay small;
+diagonal gates are a single in-place multiply.  No operator bigger than 4x4
+is ever built, so with ``complex64`` a 28-qubit state fits in 2 GiB.
+
+Every angle may be a scalar or a length-``batch`` array, so a parameter
+sweep is one vectorized run:
+
+    thetas = np.linspace(0, np.pi, 100)
+    psi = TensorState(2, batch=100).rx(thetas, 0).x(1).data   # (100, 4)
+
+``simulate(qc, {theta: thetas})`` does the same for a qiskit circuit with
+``Parameter`` angles and ``statevec(qc)`` is a drop-in for the challenge
+helper.
+"""
+import numpy as np
+
+# upper bound on elements in one temporary half-slice
+CHUNK = 1 << 22
+
+
+def _mat(rows, batch):
+    """Stack 2x2 entries that may be scalars or ``(batch,)`` arrays."""
+    m = np.empty((batch, 2, 2), dtype=complex)
+    for i in range(2):
+        for j in range(2):
+            m[:, i, j] = rows[i][j]
+    return m
+
+
+class TensorState:
+    """A batch of ``num_qubits``-qubit states, all starting in ``|0...0>``."""
+
+    def __init__(self, num_qubits, batch=1, dtype=np.complex64):
+        self.num_qubits = num_qubits
+        self.batch = batch
+        self.buffer = np.zeros((batch, 2 ** num_qubits), dtype=dtype)
+        self.buffer[:, 0] = 1
+
+    @property
+    def data(self):
+        """``(batch, 2^n)`` amplitudes, or ``(2^n,)`` for a batch of one."""
+        return self.buffer[0] if self.batch == 1 else self.buffer
+
+    def probabilities(self):
+        p = self.buffer.real ** 2 + self.buffer.imag ** 2
+        return p[0] if self.batch == 1 else p
+
+    def _split(self, qubit):
+        return self.buffer.reshape(self.batch, -1, 2, 1 << qubit)
+
+    def _chunks(self, view):
+        """Slices of ``view`` (``(B, hi, 2, lo)``) whose halves hold at most
+        ``CHUNK`` elements, cut along whichever of hi/lo is longer."""
+        B, hi, _, lo = view.shape
+        if hi >= lo:
+            step = max(1, CHUNK // (B * lo))
+            for start in range(0, hi, step):
+                yield view[:, start:start + step]
+        else:
+            step = max(1, CHUNK // (B * hi))
+            for start in range(0, lo, step):
+                yield view[:, :, :, start:start + step]
+
+    def unitary(self, mat, qubit):
+        """Apply a 2x2 ``mat`` (or a ``(batch, 2, 2)`` stack) to ``qubit``."""
+        mat = np.broadcast_to(np.asarray(mat, dtype=self.buffer.dtype), (self.batch, 2, 2))
+        m = mat[:, :, :, None, None]
+        for block in self._chunks(self._split(qubit)):
+            a0, a1 = block[:, :, 0], block[:, :, 1]
+            tmp = a0.copy()
+            a0 *= m[:, 0, 0]
+            a0 += m[:, 0, 1] * a1
+            a1 *= m[:, 1, 1]
+            a1 += m[:, 1, 0] * tmp
+        return self
+
+    def diagonal(self, d0, d1, qubit):
+        """Multiply the ``qubit = 0/1`` amplitudes by ``d0``/``d1`` in place."""
+        view = self._split(qubit)
+        for half, d in ((0, d0), (1, d1)):
+            d = np.asarray(d)
+            if d.ndim == 0 and d == 1:
+                continue
+            view[:, :, half] *= d.reshape(-1, 1, 1).astype(self.buffer.dtype) if d.ndim else d
+        return self
+
+    def _pair(self, a, b):
+        """View with qubits ``a`` and ``b`` as separate axes, plus where
+        each one's index lives among them."""
+        hi, lo = max(a, b), min(a, b)
+        view = self.buffer.reshape(self.batch, -1, 2, 1 << (hi - lo - 1), 2, 1 << lo)
+        return view, {hi: 2, lo: 4}
+
+    def _pair_chunks(self, a, b):
+        """Like ``_chunks`` for the two-qubit view: slices along the longest
+        of its three free axes."""
+        view, axes = self._pair(a, b)
+        axis = max((1, 3, 5), key=lambda k: view.shape[k])
+        rest = view.size // (4 * view.shape[axis])
+        step = max(1, CHUNK // rest)
+        for start in range(0, view.shape[axis], step):
+            index = [slice(None)] * 6
+            index[axis] = slice(start, start + step)
+            yield view[tuple(index)], axes
+
+    def _controlled_pairs(self, control, target):
+        """``(a0, a1)`` views of the target = 0/1 amplitudes with control = 1."""
+        for view, axes in self._pair_chunks(control, target):
+            index = [slice(None)] * 6
+            index[axes[control]] = 1
+            index[axes[target]] = 0
+            a0 = view[tuple(index)]
+            index[axes[target]] = 1
+            yield a0, view[tuple(index)]
+
+    def controlled(self, mat, control, target):
+        """Apply ``mat`` to ``target`` where ``control`` is 1."""
+        mat = np.broadcast_to(np.asarray(mat, dtype=self.buffer.dtype), (self.batch, 2, 2))
+        m = mat.reshape((self.batch, 2, 2, 1, 1, 1))
+        for a0, a1 in self._controlled_pairs(control, target):
+            tmp = a0.copy()
+            a0 *= m[:, 0, 0]
+            a0 += m[:, 0, 1] * a1
+            a1 *= m[:, 1, 1]
+            a1 += m[:, 1, 0] * tmp
+        return self
+
+    # -- named gates ------------------------------------------------------
+
+    def x(self, q):
+        view = self._split(q)
+        for block in self._chunks(view):
+            tmp = block[:, :, 0].copy()
+            block[:, :, 0] = block[:, :, 1]
+            block[:, :, 1] = tmp
+        return self
+
+    def y(self, q):
+        return self.unitary([[0, -1j], [1j, 0]], q)
+
+    def z(self, q):
+        return self.diagonal(1, -1, q)
+
+    def h(self, q):
+        return self.unitary(np.array([[1, 1], [1, -1]]) / np.sqrt(2), q)
+
+    def s(self, q):
+        return self.diagonal(1, 1j, q)
+
+    def sdg(self, q):
+        return self.diagonal(1, -1j, q)
+
+    def t(self, q):
+        return self.diagonal(1, np.exp(1j * np.pi / 4), q)
+
+    def tdg(self, q):
+        return self.diagonal(1, np.exp(-1j * np.pi / 4), q)
+
+    def rx(self, theta, q):
+        c, s = np.cos(np.asarray(theta) / 2), -1j * np.sin(np.asarray(theta) / 2)
+        return self.unitary(_mat([[c, s], [s, c]], self.batch), q)
+
+    def ry(self, theta, q):
+        c, s = np.cos(np.asarray(theta) / 2), np.sin(np.asarray(theta) / 2)
+        return self.unitary(_mat([[c, -s], [s, c]], self.batch), q)
+
+    def rz(self, phi, q):
+        phi = np.asarray(phi)
+        return self.diagonal(np.exp(-0.5j * phi), np.exp(0.5j * phi), q)
+
+    def p(self, lam, q):
+        return self.diagonal(1, np.exp(1j * np.asarray(lam)), q)
+
+    u1 = p
+
+    def u3(self, theta, phi, lam, q):
+        theta, phi, lam = (np.asarray(a) for a in (theta, phi, lam))
+        c, s = np.cos(theta / 2), np.sin(theta / 2)
+        return self.unitary(_mat([[c, -np.exp(1j * lam) * s],
+                                  [np.exp(1j * phi) * s, np.exp(1j * (phi + lam)) * c]],
+                                 self.batch), q)
+
+    u = u3
+
+    def u2(self, phi, lam, q):
+        return self.u3(np.pi / 2, phi, lam, q)
+
+    def cx(self, control, target):
+        for a0, a1 in self._controlled_pairs(control, target):
+            tmp = a0.copy()
+            a0[...] = a1
+            a1[...] = tmp
+        return self
+
+    def cz(self, control, target):
+        for _, a1 in self._controlled_pairs(control, target):
+            a1 *= -1
+        return self
+
+    def cp(self, lam, control, target):
+        lam = np.asarray(lam)
+        phase = np.exp(1j * lam).astype(self.buffer.dtype)
+        if lam.ndim:
+            phase = phase.reshape(-1, 1, 1, 1)
+        for _, a1 in self._controlled_pairs(control, target):
+            a1 *= phase
+        return self
+
+    cu1 = cp
+
+    def swap(self, a, b):
+        for view, axes in self._pair_chunks(a, b):
+            i01 = [slice(None)] * 6
+            i10 = [slice(None)] * 6
+            i01[axes[a]], i01[axes[b]] = 0, 1
+            i10[axes[a]], i10[axes[b]] = 1, 0
+            tmp = view[tuple(i01)].copy()
+            view[tuple(i01)] = view[tuple(i10)]
+            view[tuple(i10)] = tmp
+        return self
+
+    def id(self, q):
+        return self
+
+
+_GATES = {'x', 'y', 'z', 'h', 's', 'sdg', 't', 'tdg', 'rx', 'ry', 'rz', 'p', 'u1', 'u2', 'u3', 'u',
+          'cx', 'cz', 'cp', 'cu1', 'swap', 'id'}
+_CONTROLLED = {'cy': 'y', 'ch': 'h', 'crx': 'rx', 'cry': 'ry', 'crz': 'rz', 'cu3': 'u3'}
+
+
+def _single_qubit_matrix(name, params, batch):
+    """2x2 matrix stack of a named single-qubit gate, by running it on a
+    two-amplitude batch."""
+    probe = TensorState(1, batch=batch, dtype=complex)
+    cols = []
+    for basis in (0, 1):
+        probe.buffer[:] = 0
+        probe.buffer[:, basis] = 1
+        getattr(probe, name)(*params, 0)
+        cols.append(probe.buffer.copy())
+    return np.stack(cols, axis=-1)
+
+
+def _value(param, bindings, batch):
+    """A gate parameter as a float or a ``(batch,)`` array."""
+    if bindings and hasattr(param, 'parameters'):
+        free = param.parameters
+        if len(free) == 1:
+            (p,) = free
+            if param == p and p in bindings:
+                return np.asarray(bindings[p], dtype=float)
+        values = np.empty(batch)
+        for b in range(batch):
+            values[b] = float(param.bind({p: np.broadcast_to(bindings[p], (batch,))[b] for p in free}))
+        return values
+    return float(param)
+
+
+def simulate(qc, bindings=None, dtype=np.complex128, skip=('barrier',)):
+    """Amplitudes of a qiskit ``QuantumCircuit`` without measurements.
+
+    ``bindings`` maps ``Parameter`` objects to arrays of equal length, which
+    becomes the batch dimension; the result is ``(batch, 2^n)`` then, and
+    ``(2^n,)`` otherwise.  Instructions named in ``skip`` are ignored.
+    """
+    batch = 1
+    if bindings:
+        batch = len(np.atleast_1d(next(iter(bindings.values()))))
+    state = TensorState(qc.num_qubits, batch=batch, dtype=dtype)
+    for instr, qargs, _ in qc.data:
+        name = instr.name
+        qubits = [qc.qubits.index(q) for q in qargs]
+        if name in skip:
+            continue
+        params = [_value(p, bindings, batch) for p in instr.params] if name != 'unitary' else []
+        if name in _CONTROLLED:
+            state.controlled(_single_qubit_matrix(_CONTROLLED[name], params, batch), *qubits)
+        elif name in _GATES:
+            getattr(state, name)(*params, *qubits)
+        elif len(qubits) == 1 and not bindings:
+            state.unitary(instr.to_matrix(), qubits[0])
+        else:
+            raise NotImplementedError("gate '%s' is not supported by the tensor engine" % name)
+    return state.data
+
+
+def statevec(qc, dtype=np.complex128):
+    """Drop-in for ``may4_challenge.ex1.statevec``: a qiskit ``Statevector``."""
+    from qiskit.quantum_info import Statevector
+
+    return Statevector(simulate(qc, dtype=dtype))
@@ -0,0 +1,157 @@
+"""A local store of readout calibrations, so a session can skip ``meas_calibs``.
+
+Calibrations are kept per backend name and qubit list, one directory per
+timestamp:
+
+    <path>/<backend>/<q0-q1-...>/<unix time>/meta.json
+                                            /cal_matrix.npy, lu.npy, piv.npy, ...
+
+Matrices and their factors are plain ``.npy`` files loaded with
+``mmap_mode='r'``.  A load takes milliseconds and never refactorizes, and
+worker processes reading the same calibration share the page cache instead
+of holding private copies.  A new entry is written into a temporary
+directory and renamed into place, so readers never see a partial one.
+``max_age`` sets how old a calibration may be before it counts as stale.
+
+    store = CalibrationStore(max_age=6 * 3600)
+    mitigator = store.get_or_run(backend, range(5), calibrate)
+    mitigated = mitigator.apply(noisy_counts)
+"""
+import contextlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from mitigation import BatchMitigator, TensoredMitigator
+
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'may4-ex2')
+
+
+def backend_name(backend):
+    """The name of a backend object (``name()`` or ``name``) or a string."""
+    if isinstance(backend, str):
+        return backend
+    name = backend.name
+    return name() if callable(name) else name
+
+
+class CalibrationStore:
+    """Calibrations in directory ``path`` (``$MAY4_EX2_CALIBRATIONS`` or
+    ``~/.cache/may4-ex2`` by default), fresh for ``max_age`` seconds."""
+
+    def __init__(self, path=None, max_age=24 * 3600):
+        self.path = path or os.environ.get('MAY4_EX2_CALIBRATIONS', DEFAULT_DIR)
+        self.max_age = max_age
+        os.makedirs(self.path, exist_ok=True)
+
+    def _dir(self, backend, qubits):
+        return os.path.join(self.path, backend_name(backend), '-'.join(str(q) for q in qubits))
+
+    def timestamps(self, backend, qubits):
+        """Timestamps of the stored calibrations, newest first."""
+        try:
+            names = os.listdir(self._dir(backend, qubits))
+        except FileNotFoundError:
+            return []
+        stamps = []
+        for name in names:
+            with contextlib.suppress(ValueError):
+                stamps.append(float(name))
+        return sorted(stamps, reverse=True)
+
+    def save(self, backend, qubits, mitigator, timestamp=None, **meta):
+        """Store ``mitigator`` (a ``BatchMitigator`` or ``TensoredMitigator``)
+        and return its timestamp.  ``meta`` must be JSON-serialisable."""
+        timestamp = time.time() if timestamp is None else timestamp
+        parent = self._dir(backend, qubits)
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp')
+        try:
+            arrays = {}
+            if isinstance(mitigator, BatchMitigator):
+                meta.update(kind='batch', solver=mitigator.solver, state_labels=mitigator.state_labels)
+                arrays['cal_matrix'] = mitigator.cal_matrix
+                if mitigator.solver == 'lu':
+                    arrays['lu'], arrays['piv'] = mitigator.factor
+                else:
+                    arrays['pinv'] = mitigator.factor
+            elif isinstance(mitigator, TensoredMitigator):
+                meta.update(kind='tensored', groups=mitigator.groups, num_qubits=mitigator.num_qubits)
+                for i, (M, inv) in enumerate(zip(mitigator.matrices, mitigator.inverses)):
+                    arrays['matrix_%d' % i], arrays['inverse_%d' % i] = M, inv
+            else:
+                raise TypeError('cannot store %r' % type(mitigator).__name__)
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp, name + '.npy'), np.asarray(array))
+            meta.update(backend=backend_name(backend), qubits=list(qubits), timestamp=timestamp)
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+            # a directory rename is atomic; losing a race to an identical
+            # timestamp leaves the other writer's entry in place
+            with contextlib.suppress(OSError):
+                os.rename(tmp, os.path.join(parent, '%.6f' % timestamp))
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return timestamp
+
+    def load(self, backend, qubits, max_age=None, now=None):
+        """The newest calibration younger than ``max_age`` (the store's
+        default if ``None``) as a mitigator over memory-mapped arrays, or
+        ``None``."""
+        max_age = self.max_age if max_age is None else max_age
+        now = time.time() if now is None else now
+        for stamp in self.timestamps(backend, qubits):
+            if now - stamp > max_age:
+                return None
+            entry = os.path.join(self._dir(backend, qubits), '%.6f' % stamp)
+            with contextlib.suppress(FileNotFoundError):
+                return self._read(entry)
+        return None
+
+    @staticmethod
+    def _read(entry):
+        with open(os.path.join(entry, 'meta.json')) as f:
+            meta = json.load(f)
+
+        def array(name):
+            return np.load(os.path.join(entry, name + '.npy'), mmap_mode='r')
+
+        if meta['kind'] == 'batch':
+            if meta['solver'] == 'lu':
+                # the pivots are tiny, and lu_solve crashes on a read-only pivot array
+                factor = array('lu'), np.load(os.path.join(entry, 'piv.npy'))
+            else:
+                factor = array('pinv')
+            mitigator = BatchMitigator(array('cal_matrix'), meta['state_labels'], meta['solver'], factor)
+        else:
+            count = len(meta['groups'])
+            mitigator = TensoredMitigator(meta['groups'], [array('matrix_%d' % i) for i in range(count)],
+                                          meta['num_qubits'],
+                                          [array('inverse_%d' % i) for i in range(count)])
+        mitigator.meta = meta
+        return mitigator
+
+    def get_or_run(self, backend, qubits, calibrate, max_age=None, **meta):
+        """A fresh stored calibration, or ``calibrate()`` (which runs the
+        calibration circuits and returns a mitigator) stored and returned."""
+        mitigator = self.load(backend, qubits, max_age)
+        if mitigator is None:
+            mitigator = calibrate()
+            self.save(backend, qubits, mitigator, **meta)
+        return mitigator
+
+    def prune(self, keep=1):
+        """Delete all but the ``keep`` newest calibrations of every backend
+        and qubit list."""
+        for backend in os.listdir(self.path):
+            root = os.path.join(self.path, backend)
+            if not os.path.isdir(root):
+                continue
+            for qubits in os.listdir(root):
+                stamps = self.timestamps(backend, qubits.split('-'))
+                for stamp in stamps[keep:]:
+                    shutil.rmtree(os.path.join(root, qubits, '%.6f' % stamp), ignore_errors=True)
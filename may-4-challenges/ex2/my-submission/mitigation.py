@@ -0,0 +1,305 @@
+"""Measurement error mitigation with a tensored calibration.
+
+``complete_meas_cal`` prepares all ``2^n`` basis states and
+``CompleteMeasFitter`` inverts a dense ``2^n x 2^n`` matrix.  Here the
+register is split into groups of qubits whose readout errors are treated as
+independent of each other, e.g. ``[[0], [1], [2, 3], [4]]`` when qubits 2 and
+3 are correlated.  Every group gets its own ``2^k x 2^k`` matrix, and all
+groups are calibrated in parallel, so only ``2^max_k`` circuits are needed
+whatever the register size (two for single-qubit groups).
+
+The full matrix is the Kronecker product of the group matrices.  It is never
+formed: mitigation applies one group inverse at a time to the sparse count
+dictionary, and entries that fall below ``prune`` are dropped on the way.
+
+    circuits, labels = tensored_meas_cal([[0], [1], [2, 3], [4]])
+    mitigator = fit_tensored(backend.run(circuits).result(), [[0], [1], [2, 3], [4]])
+    mitigated = mitigator.apply(noisy_counts[0])                   # quasi-probabilities
+    mitigated = mitigator.apply(noisy_counts[0], 'least_squares')  # a valid distribution
+
+``BatchMitigator`` is for a dense calibration, e.g. ``CompleteMeasFitter``'s:
+it factorizes the matrix once and mitigates a stack of count vectors per
+call, with the constrained fit run on all of them together.
+
+    batch = BatchMitigator.from_fitter(meas_fitter)
+    mitigated = batch.apply(noisy_counts)        # all four at once
+"""
+import numpy as np
+
+METHODS = ('inverse', 'nearest', 'least_squares')
+
+
+def _local(keys, qubits):
+    """The bits of ``keys`` on ``qubits`` as group-local indices."""
+    local = np.zeros(len(keys), dtype=np.int64)
+    for i, q in enumerate(qubits):
+        local |= ((keys >> q) & 1) << i
+    return local
+
+
+def _scatter(qubits):
+    """``_scatter(qubits)[s]`` places local index ``s`` back on ``qubits``."""
+    s = np.arange(1 << len(qubits), dtype=np.int64)
+    out = np.zeros_like(s)
+    for i, q in enumerate(qubits):
+        out |= ((s >> i) & 1) << q
+    return out
+
+
+def _num_qubits(groups):
+    return max(q for g in groups for q in g) + 1
+
+
+def _labels(groups, num_qubits):
+    """The basis state each calibration circuit prepares, as a bit string."""
+    size = max(len(g) for g in groups)
+    return [format(sum(int(_scatter(g)[j % (1 << len(g))]) for g in groups), '0%db' % num_qubits)
+            for j in range(1 << size)]
+
+
+def counts_to_arrays(counts):
+    """``(keys, values)`` arrays of a qiskit counts dict; spaces between
+    registers are dropped."""
+    keys = np.fromiter((int(k.replace(' ', ''), 2) for k in counts), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=float, count=len(counts))
+    return keys, values
+
+
+def arrays_to_counts(keys, values, num_qubits):
+    return {format(int(k), '0%db' % num_qubits): float(v) for k, v in zip(keys, values)}
+
+
+def apply_factors(keys, values, groups, mats, prune=0.0):
+    """``(kron of mats) @ x`` for a sparse ``x`` given as ``keys, values``,
+    one group at a time.  Entries with ``|value| <= prune * sum|values|``
+    are dropped after each group."""
+    for qubits, M in zip(groups, mats):
+        mask = sum(1 << q for q in qubits)
+        local = _local(keys, qubits)
+        new_keys = ((keys & ~mask)[:, None] | _scatter(qubits)[None, :]).ravel()
+        new_values = (values[:, None] * M[:, local].T).ravel()
+        keys, inverse = np.unique(new_keys, return_inverse=True)
+        values = np.bincount(inverse, weights=new_values, minlength=len(keys))
+        if prune:
+            keep = np.abs(values) > prune * np.abs(values).sum()
+            keys, values = keys[keep], values[keep]
+    return keys, values
+
+
+def project_simplex(v):
+    """Euclidean projection of each row of ``v`` onto the probability
+    simplex: the closest distribution to a quasi-probability vector
+    (Smolin, Gambetta and Smith, PRL 108, 070502)."""
+    v = np.asarray(v, dtype=float)
+    u = -np.sort(-v, axis=-1)
+    css = np.cumsum(u, axis=-1) - 1
+    k = np.arange(1, v.shape[-1] + 1)
+    rho = np.count_nonzero(u - css / k > 0, axis=-1)
+    theta = np.take_along_axis(css, (rho - 1)[..., None], axis=-1) / rho[..., None]
+    return np.maximum(v - theta, 0)
+
+
+def tensored_meas_cal(groups, num_qubits=None, circlabel='mcal'):
+    """Calibration circuits for ``groups`` and their state labels.
+
+    Circuit ``j`` prepares ``j mod 2^k`` on every group of ``k`` qubits, so
+    ``2^max_k`` circuits cover every group state.  Names follow
+    ``complete_meas_cal``: ``circlabel + 'cal_' + label``.
+    """
+    from qiskit import ClassicalRegister, QuantumCircuit, QuantumRegister
+
+    num_qubits = num_qubits or _num_qubits(groups)
+    labels = _labels(groups, num_qubits)
+    measured = sorted(q for g in groups for q in g)
+    circuits = []
+    for label in labels:
+        qr, cr = QuantumRegister(num_qubits), ClassicalRegister(num_qubits)
+        qc = QuantumCircuit(qr, cr, name='%scal_%s' % (circlabel, label))
+        for q in range(num_qubits):
+            if label[num_qubits - 1 - q] == '1':
+                qc.x(qr[q])
+        qc.measure([qr[q] for q in measured], [cr[q] for q in measured])
+        circuits.append(qc)
+    return circuits, labels
+
+
+def fit_tensored(results, groups, num_qubits=None, labels=None, circlabel='mcal'):
+    """A ``TensoredMitigator`` from calibration results.
+
+    ``results`` is a qiskit ``Result`` of the ``tensored_meas_cal`` circuits,
+    or a list of their counts dicts in order.  Each group matrix is filled
+    from the counts marginalized to that group, ``A[measured, prepared]``,
+    and normalized column by column.
+    """
+    num_qubits = num_qubits or _num_qubits(groups)
+    labels = labels or _labels(groups, num_qubits)
+    if hasattr(results, 'get_counts'):
+        counts = [results.get_counts('%scal_%s' % (circlabel, label)) for label in labels]
+    else:
+        counts = list(results)
+    mats = [np.zeros((1 << len(g), 1 << len(g))) for g in groups]
+    for label, c in zip(labels, counts):
+        prepared = np.array([int(label, 2)], dtype=np.int64)
+        keys, values = counts_to_arrays(c)
+        for qubits, M in zip(groups, mats):
+            M[:, _local(prepared, qubits)[0]] += np.bincount(_local(keys, qubits), weights=values,
+                                                             minlength=len(M))
+    for M in mats:
+        M /= M.sum(axis=0, keepdims=True)
+    return TensoredMitigator(groups, mats, num_qubits)
+
+
+class TensoredMitigator:
+    """Readout mitigation with one calibration matrix per group of qubits;
+    the group inverses are computed once."""
+
+    def __init__(self, groups, matrices, num_qubits=None, inverses=None):
+        self.groups = [tuple(g) for g in groups]
+        self.matrices = [np.asarray(M, dtype=float) for M in matrices]
+        self.num_qubits = num_qubits or _num_qubits(self.groups)
+        if inverses is None:
+            inverses = [np.linalg.inv(M) for M in self.matrices]
+        self.inverses = inverses
+
+    def cal_matrix(self):
+        """The dense ``2^n x 2^n`` matrix, for comparison on small registers."""
+        dim = 1 << self.num_qubits
+        keys = np.arange(dim, dtype=np.int64)
+        cols = [apply_factors(np.array([k]), np.ones(1), self.groups, self.matrices) for k in keys]
+        full = np.zeros((dim, dim))
+        for k, (rows, values) in zip(keys, cols):
+            full[rows, k] = values
+        return full
+
+    def apply(self, counts, method='inverse', prune=1e-8, max_iter=200, tol=1e-10):
+        """Mitigated counts, scaled to the same number of shots.
+
+        ``'inverse'`` applies the factored inverse and may return negative
+        quasi-counts; ``'nearest'`` projects that onto the closest valid
+        distribution; ``'least_squares'`` minimizes ``|A x - p|`` over
+        distributions on the same support by projected gradient, starting
+        from ``'nearest'``.
+        """
+        if method not in METHODS:
+            raise ValueError('method must be one of %s' % (METHODS,))
+        keys, values = counts_to_arrays(counts)
+        shots = values.sum()
+        p = values / shots
+        keys_x, x = apply_factors(keys, p, self.groups, self.inverses, prune)
+        if method != 'inverse':
+            x = project_simplex(x)
+        if method == 'least_squares':
+            x = self._least_squares(keys, p, keys_x, x, max_iter, tol)
+        keep = x != 0
+        return arrays_to_counts(keys_x[keep], x[keep] * shots, self.num_qubits)
+
+    def _least_squares(self, keys_p, p, keys_x, x, max_iter, tol):
+        # the step 1/L uses L = prod ||A_g||^2 >= ||A||^2
+        step = 1 / np.prod([np.linalg.norm(M, 2) ** 2 for M in self.matrices])
+        transposed = [M.T for M in self.matrices]
+        for _ in range(max_iter):
+            keys_r, r = apply_factors(keys_x, x, self.groups, self.matrices)
+            # residual A x - p on the union of both supports
+            keys_r, inverse = np.unique(np.concatenate((keys_r, keys_p)), return_inverse=True)
+            r = np.bincount(inverse, weights=np.concatenate((r, -p)), minlength=len(keys_r))
+            keys_g, g = apply_factors(keys_r, r, self.groups, transposed)
+            grad = np.zeros_like(x)
+            at = np.searchsorted(keys_g, keys_x)
+            found = (at < len(keys_g)) & (keys_g[np.minimum(at, len(keys_g) - 1)] == keys_x)
+            grad[found] = g[at[found]]
+            new = project_simplex(x - step * grad)
+            if np.abs(new - x).sum() < tol:
+                return new
+            x = new
+        return x
+
+    def dense(self):
+        """A ``BatchMitigator`` over the full matrix, for small registers
+        with many count vectors to mitigate."""
+        labels = [format(k, '0%db' % self.num_qubits) for k in range(1 << self.num_qubits)]
+        return BatchMitigator(self.cal_matrix(), labels)
+
+
+class BatchMitigator:
+    """Mitigate many count vectors against one calibration matrix.
+
+    ``cal_matrix`` and ``state_labels`` are those of ``CompleteMeasFitter``
+    (``BatchMitigator.from_fitter(meas_fitter)``).  The matrix is factorized
+    once, as an LU factor (``solver='lu'``) or a pseudo-inverse
+    (``solver='pinv'``, for ill-conditioned calibrations), and every call
+    mitigates a whole stack of count vectors with one solve.  A ``factor``
+    computed earlier (``(lu, piv)`` or the pseudo-inverse) skips that step.
+    """
+
+    def __init__(self, cal_matrix, state_labels, solver='lu', factor=None):
+        self.cal_matrix = np.asarray(cal_matrix, dtype=float)
+        self.state_labels = list(state_labels)
+        self.index = {label: i for i, label in enumerate(self.state_labels)}
+        if solver not in ('lu', 'pinv'):
+            raise ValueError("solver must be 'lu' or 'pinv'")
+        self.solver = solver
+        if factor is None and solver == 'lu':
+            from scipy.linalg import lu_factor
+
+            factor = lu_factor(self.cal_matrix)
+        elif factor is None:
+            factor = np.linalg.pinv(self.cal_matrix)
+        self.factor = factor
+        self._gram = None
+
+    @classmethod
+    def from_fitter(cls, fitter, solver='lu'):
+        return cls(fitter.cal_matrix, fitter.state_labels, solver)
+
+    def to_matrix(self, counts_list):
+        """Stack counts dicts into a ``(K, 2^n)`` array in label order."""
+        P = np.zeros((len(counts_list), len(self.state_labels)))
+        for row, counts in zip(P, counts_list):
+            for key, value in counts.items():
+                row[self.index[key.replace(' ', '')]] += value
+        return P
+
+    def to_counts(self, X):
+        return [{label: float(v) for label, v in zip(self.state_labels, row) if v != 0} for row in X]
+
+    def solve(self, P):
+        """``A^-1 p`` for every row ``p`` of ``P`` in one solve."""
+        if self.solver == 'lu':
+            from scipy.linalg import lu_solve
+
+            return lu_solve(self.factor, P.T).T
+        return P @ self.factor.T
+
+    def least_squares(self, P, max_iter=500, tol=1e-10):
+        """``argmin |A x - p|`` over distributions for every row of ``P``
+        (normalized), by projected gradient on the whole stack at once."""
+        if self._gram is None:
+            self._gram = self.cal_matrix.T @ self.cal_matrix
+            self._step = 1 / np.linalg.norm(self.cal_matrix, 2) ** 2
+        P = P / P.sum(axis=1, keepdims=True)
+        X = project_simplex(self.solve(P))
+        PA = P @ self.cal_matrix
+        for _ in range(max_iter):
+            new = project_simplex(X - self._step * (X @ self._gram - PA))
+            if np.abs(new - X).sum(axis=1).max() < tol:
+                return new
+            X = new
+        return X
+
+    def apply(self, counts, method='least_squares', max_iter=500, tol=1e-10):
+        """Mitigated counts for one counts dict or a list of them, like
+        ``meas_filter.apply``; methods as in ``TensoredMitigator.apply``."""
+        if method not in METHODS:
+            raise ValueError('method must be one of %s' % (METHODS,))
+        single = isinstance(counts, dict)
+        counts_list = [counts] if single else list(counts)
+        P = self.to_matrix(counts_list)
+        shots = P.sum(axis=1, keepdims=True)
+        if method == 'inverse':
+            X = self.solve(P)
+        elif method == 'nearest':
+            X = project_simplex(self.solve(P) / shots) * shots
+        else:
+            X = self.least_squares(P, max_iter, tol) * shots
+        out = self.to_counts(X)
+        return out[0] if single else out
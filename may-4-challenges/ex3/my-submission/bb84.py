@@ -0,0 +1,123 @@
+"""Vectorized BB84 channel simulation on NumPy bit arrays.
+
+``bb84()`` in the notebook builds one circuit per qubit and submits them with
+``shots=1``.  Here bits and bases are ``uint8`` arrays and Bob's outcomes
+are computed in bulk: where the bases match he reads Alice's bit, where
+they differ he gets a seeded coin flip.  Both paths draw one uniform number
+per qubit from the same seeded generator and report 1 when it falls below
+the probability of measuring 1, so ``simulate_bb84`` and ``run_circuits``
+agree bit for bit for a given seed.
+
+An intercept-resend eavesdropper and a depolarizing channel can be added;
+each uses its own uniforms, drawn after Bob's, so enabling them does not
+change the coin flips of an otherwise identical run.
+
+    bob_bases = notebook_bases(84, 100)          # same string as the notebook
+    bob_bits = simulate_bb84(alice_bits, alice_bases, bob_bases, seed=1)
+"""
+import random
+
+import numpy as np
+
+
+def str_to_bits(s):
+    """``'0110'`` -> ``array([0, 1, 1, 0], dtype=uint8)``."""
+    return np.frombuffer(s.encode('ascii'), dtype=np.uint8) - ord('0')
+
+
+def bits_to_str(bits):
+    return (np.asarray(bits, dtype=np.uint8) + ord('0')).tobytes().decode('ascii')
+
+
+def notebook_bases(seed=84, numqubits=100):
+    """Bob's bases exactly as the notebook draws them,
+    ``'{0:0100b}'.format(random.getrandbits(100))`` after ``random.seed(84)``,
+    without going through a string (fine for millions of qubits)."""
+    value = random.Random(seed).getrandbits(numqubits)
+    nbytes = (numqubits + 7) // 8
+    bits = np.unpackbits(np.frombuffer(value.to_bytes(nbytes, 'big'), dtype=np.uint8))
+    return bits[8 * nbytes - numqubits:]
+
+
+def _uniforms(seed, n, streams):
+    """``streams`` arrays of ``n`` uniforms from one generator, always drawn
+    in the same order."""
+    rng = np.random.default_rng(seed)
+    return [rng.random(n) for _ in range(streams)]
+
+
+def simulate_bb84(alice_bits, alice_bases, bob_bases, seed=None, eve=0.0, depolarizing=0.0):
+    """Bob's measured bits as a ``uint8`` array.
+
+    ``eve`` is the fraction of qubits intercepted and resent in a random
+    basis, ``depolarizing`` the probability that a qubit reaches Bob fully
+    mixed.  Basis 0 is Z, basis 1 is X.
+    """
+    alice_bits = np.asarray(alice_bits, dtype=np.uint8)
+    alice_bases = np.asarray(alice_bases, dtype=np.uint8)
+    bob_bases = np.asarray(bob_bases, dtype=np.uint8)
+    n = len(alice_bits)
+    streams = 1 + (3 if eve else 0) + (1 if depolarizing else 0)
+    u = _uniforms(seed, n, streams)
+    u_bob = u.pop(0)
+
+    bits, bases = alice_bits, alice_bases
+    mixed = np.zeros(n, dtype=bool)
+    if eve:
+        u_hit, u_basis, u_meas = u.pop(0), u.pop(0), u.pop(0)
+        hit = u_hit < eve
+        eve_bases = (u_basis < 0.5).astype(np.uint8)
+        eve_bits = np.where(eve_bases == bases, bits, u_meas < 0.5).astype(np.uint8)
+        bits = np.where(hit, eve_bits, bits)
+        bases = np.where(hit, eve_bases, bases)
+    if depolarizing:
+        mixed = u.pop(0) < depolarizing
+    p1 = np.where((bases == bob_bases) & ~mixed, bits, 0.5)
+    return (u_bob < p1).astype(np.uint8)
+
+
+def prepare_circuit(bit, basis):
+    """The single-qubit BB84 state as a circuit with one clbit."""
+    from qiskit import QuantumCircuit
+
+    qc = QuantumCircuit(1, 1)
+    if bit:
+        qc.x(0)
+    if basis:
+        qc.h(0)
+    return qc
+
+
+def bob_measure(qc, basis):
+    """Bob's side of the notebook's ``bob_measure_qubit``."""
+    if basis:
+        qc.h(0)
+    qc.measure(0, 0)
+    return qc
+
+
+def alice_state(qc):
+    """``(bit, basis)`` of a prepared single-qubit circuit, e.g. one from
+    ``alice_prepare_qubit``, read off its statevector."""
+    amps = _amplitudes(qc)
+    if abs(abs(amps[0]) - abs(amps[1])) > 1e-6:
+        return int(abs(amps[1]) > abs(amps[0])), 0
+    return int(abs(amps[0] + amps[1]) < abs(amps[0] - amps[1])), 1
+
+
+def _amplitudes(qc):
+    state = np.array([1, 0], dtype=complex)
+    for instr, _, _ in qc.data:
+        if instr.name in ('measure', 'barrier'):
+            continue
+        state = np.asarray(instr.to_matrix()) @ state
+    return state
+
+
+def run_circuits(circuits, seed=None):
+    """The circuit path: measure each single-qubit circuit once, drawing the
+    same uniforms as ``simulate_bb84`` (equivalent to ``execute(...,
+    shots=1)`` but reproducible)."""
+    u = _uniforms(seed, len(circuits), 1)[0]
+    p1 = np.array([abs(_amplitudes(qc)[1]) ** 2 for qc in circuits])
+    return (u < np.round(p1, 12)).astype(np.uint8)
@@ -0,0 +1,268 @@
+"""Streaming key distillation for BB84 over packed bit arrays.
+
+Every stage is a generator that takes and yields chunks, so a session of
+any length runs in memory bounded by the chunk size:
+
+    ledger = Ledger()
+    raw = bb84_chunks(10 ** 7, chunk=1 << 20, seed=1, eve=0.1)
+    keys = amplify(reconcile(estimate_qber(sift(raw, ledger), ledger), ledger), ledger)
+    for alice, bob in keys:
+        ...
+
+Bits travel as ``Bits(packed, length)``, an ``np.packbits`` array plus the
+number of valid bits.  A stage unpacks only its current chunk.
+
+- ``sift`` keeps the positions where Alice's and Bob's bases agree;
+- ``estimate_qber`` discloses a random sample of the sifted bits, counts the
+  errors and drops the sample;
+- ``reconcile`` corrects Bob's bits with parity checks and a binary search
+  in each mismatched block, over several shuffled passes, verifies the
+  result with a short hash and counts every parity bit it discloses;
+- ``amplify`` compresses both keys with the same random Toeplitz matrix,
+  a convolution computed with an FFT, to what is left after the
+  leaked bits and Eve's estimated information;
+- ``xor_stream`` encrypts or decrypts a bit stream with a key stream.
+  ``repeat=True`` reuses the key, as the notebook does with its 50-bit key.
+
+``decode_morse`` reads the notebook's message encoding.
+"""
+import itertools
+from collections import namedtuple
+
+import numpy as np
+
+import bb84
+
+
+class Bits(namedtuple('Bits', 'packed length')):
+    """``length`` bits stored as an ``np.packbits`` array."""
+    __slots__ = ()
+
+    @classmethod
+    def from_array(cls, bits):
+        bits = np.asarray(bits, dtype=np.uint8)
+        return cls(np.packbits(bits), len(bits))
+
+    @classmethod
+    def from_str(cls, s):
+        return cls.from_array(bb84.str_to_bits(s))
+
+    def array(self):
+        return np.unpackbits(self.packed, count=self.length)
+
+    def __str__(self):
+        return bb84.bits_to_str(self.array())
+
+
+# one block of raw BB84 data
+Raw = namedtuple('Raw', 'alice_bits alice_bases bob_bits bob_bases')
+
+
+class Ledger:
+    """Running totals of a session, updated by the stages as chunks pass."""
+
+    def __init__(self):
+        self.raw = 0
+        self.sifted = 0
+        self.sampled = 0
+        self.errors = 0
+        self.leaked = 0
+        self.discarded = 0
+        self.final = 0
+
+    @property
+    def qber(self):
+        return self.errors / self.sampled if self.sampled else 0.0
+
+    def __repr__(self):
+        return ('Ledger(raw=%d, sifted=%d, sampled=%d, qber=%.4f, leaked=%d, discarded=%d, '
+                'final=%d)' % (self.raw, self.sifted, self.sampled, self.qber, self.leaked,
+                               self.discarded, self.final))
+
+
+def bb84_chunks(numqubits, chunk=1 << 20, seed=None, **channel):
+    """Simulated raw BB84 data in chunks of ``chunk`` qubits. ``channel``
+    goes to ``bb84.simulate_bb84``."""
+    rng = np.random.default_rng(seed)
+    for start in range(0, numqubits, chunk):
+        n = min(chunk, numqubits - start)
+        alice_bits, alice_bases, bob_bases = rng.integers(0, 2, (3, n), dtype=np.uint8)
+        bob_bits = bb84.simulate_bb84(alice_bits, alice_bases, bob_bases,
+                                      seed=rng.integers(1 << 63), **channel)
+        yield Raw(*(Bits.from_array(b) for b in (alice_bits, alice_bases, bob_bits, bob_bases)))
+
+
+def sift_key(bits, bases, other_bases):
+    """The bits of ``bits`` where ``bases`` and ``other_bases`` agree."""
+    agree = np.unpackbits(~(bases.packed ^ other_bases.packed), count=bits.length).astype(bool)
+    return Bits.from_array(bits.array()[agree])
+
+
+def sift(chunks, ledger=None):
+    """``Raw`` chunks -> ``(alice_key, bob_key)`` pairs."""
+    for raw in chunks:
+        alice = sift_key(raw.alice_bits, raw.alice_bases, raw.bob_bases)
+        bob = sift_key(raw.bob_bits, raw.bob_bases, raw.alice_bases)
+        if ledger is not None:
+            ledger.raw += raw.alice_bits.length
+            ledger.sifted += alice.length
+        yield alice, bob
+
+
+def estimate_qber(pairs, ledger, fraction=0.1, seed=None):
+    """Disclose a ``fraction`` of every chunk, add the mismatches to
+    ``ledger`` and pass on the undisclosed rest."""
+    rng = np.random.default_rng(seed)
+    for alice, bob in pairs:
+        a, b = alice.array(), bob.array()
+        sample = rng.random(len(a)) < fraction
+        ledger.sampled += int(sample.sum())
+        ledger.errors += int(np.count_nonzero(a[sample] != b[sample]))
+        yield Bits.from_array(a[~sample]), Bits.from_array(b[~sample])
+
+
+def _parity(rows):
+    return np.bitwise_xor.reduce(rows, axis=-1)
+
+
+def _binary(a, b, block):
+    """One pass: compare the parity of each ``block`` bits and fix one error
+    in every block that differs by binary search, all blocks at once.
+    Corrects ``b`` in place and returns the number of disclosed parities."""
+    pad = -len(a) % block
+    A = np.concatenate((a, np.zeros(pad, dtype=np.uint8))).reshape(-1, block)
+    B = np.concatenate((b, np.zeros(pad, dtype=np.uint8))).reshape(-1, block)
+    bad = np.flatnonzero(_parity(A) != _parity(B))
+    lo = np.zeros(len(bad), dtype=np.intp)
+    width = block
+    while width > 1:
+        width //= 2
+        cols = lo[:, None] + np.arange(width)
+        differs = _parity(A[bad[:, None], cols]) != _parity(B[bad[:, None], cols])
+        lo = np.where(differs, lo, lo + width)
+    B[bad, lo] ^= 1
+    b[:] = B.ravel()[:len(b)]
+    return len(A) + len(bad) * (block.bit_length() - 1)
+
+
+def block_size(qber):
+    """Cascade's first block size, ``0.73 / qber``, as a power of two."""
+    if qber <= 0:
+        return 1024
+    return int(np.clip(2 ** np.round(np.log2(0.73 / qber)), 4, 1024))
+
+
+def reconcile(pairs, ledger, passes=10, block=None, verify=64, seed=None):
+    """Correct Bob's key towards Alice's with ``passes`` binary passes,
+    shuffling the bits between them and doubling the block size every
+    second pass.  The block size follows the QBER in ``ledger`` unless
+    ``block`` is given.
+
+    Even error counts in a block survive a pass, so each chunk is then
+    checked with a ``verify``-bit Toeplitz hash and dropped if the hashes
+    still differ (counted in ``ledger.discarded``).
+    """
+    rng = np.random.default_rng(seed)
+    for alice, bob in pairs:
+        a, b = alice.array(), bob.array()
+        size = block or block_size(ledger.qber)
+        leaked = 0
+        for k in range(passes):
+            perm = rng.permutation(len(a))
+            ap, bp = a[perm], b[perm]
+            leaked += _binary(ap, bp, size << (k // 2))
+            b[perm] = bp
+        if verify:
+            seed_bits = rng.integers(0, 2, len(a) + verify - 1, dtype=np.uint8)
+            leaked += verify
+            if (toeplitz_hash(a, seed_bits, verify) != toeplitz_hash(b, seed_bits, verify)).any():
+                ledger.leaked += leaked
+                ledger.discarded += len(a)
+                continue
+        ledger.leaked += leaked
+        yield Bits.from_array(a), Bits.from_array(b), leaked
+
+
+def _entropy(p):
+    if p <= 0 or p >= 1:
+        return 0.0
+    return float(-p * np.log2(p) - (1 - p) * np.log2(1 - p))
+
+
+def toeplitz_hash(bits, seed_bits, m):
+    """``T @ bits mod 2`` for the ``m x n`` Toeplitz matrix whose first
+    column and row are given by the ``n + m - 1`` ``seed_bits``, as a
+    full convolution computed with an FFT."""
+    n = len(bits)
+    size = 1 << (n + len(seed_bits) - 1).bit_length()
+    conv = np.fft.irfft(np.fft.rfft(seed_bits, size) * np.fft.rfft(bits, size), size)
+    return (np.rint(conv[n - 1:n - 1 + m]).astype(np.int64) & 1).astype(np.uint8)
+
+
+def amplify(triples, ledger, security=64, seed=None):
+    """Shorten each reconciled chunk to
+    ``n (1 - h(qber)) - leaked - security`` bits with a fresh public
+    Toeplitz seed; chunks with nothing left are dropped."""
+    rng = np.random.default_rng(seed)
+    for alice, bob, leaked in triples:
+        n = alice.length
+        m = int(n * (1 - _entropy(ledger.qber)) - leaked - security)
+        if m <= 0:
+            continue
+        seed_bits = rng.integers(0, 2, n + m - 1, dtype=np.uint8)
+        ledger.final += m
+        yield (Bits.from_array(toeplitz_hash(alice.array(), seed_bits, m)),
+               Bits.from_array(toeplitz_hash(bob.array(), seed_bits, m)))
+
+
+def xor_stream(data, key, repeat=False):
+    """XOR a stream of ``Bits`` with a key stream of ``Bits``, yielding one
+    chunk per data chunk.  With ``repeat`` the key starts over when it runs
+    out; otherwise running out is an error."""
+    key = iter(key)
+    seen = [] if repeat else None
+    buf = np.zeros(0, dtype=np.uint8)
+    for chunk in data:
+        while len(buf) < chunk.length:
+            k = next(key, None)
+            if k is None:
+                if not seen:
+                    raise ValueError('key stream is shorter than the data')
+                key, seen = itertools.cycle(seen), None
+                continue
+            if seen is not None:
+                seen.append(k)
+            buf = np.concatenate((buf, k.array()))
+        yield Bits.from_array(chunk.array() ^ buf[:chunk.length])
+        buf = buf[chunk.length:]
+
+
+def decrypt(message, key, repeat=True):
+    """The notebook's decryption on bit strings: ``message`` XOR the
+    repeated ``key``."""
+    return str(next(xor_stream([Bits.from_str(message)], [Bits.from_str(key)], repeat)))
+
+
+MORSE_CODE_DICT = {'a': '.-', 'b': '-...', 'c': '-.-.', 'd': '-..', 'e': '.', 'f': '..-.',
+                   'g': '--.', 'h': '....', 'i': '..', 'j': '.---', 'k': '-.-', 'l': '.-..',
+                   'm': '--', 'n': '-.', 'o': '---', 'p': '.--.', 'q': '--.-', 'r': '.-.',
+                   's': '...', 't': '-', 'u': '..-', 'v': '...-', 'w': '.--', 'x': '-..-',
+                   'y': '-.--', 'z': '--..', '1': '.----', '2': '..---', '3': '...--',
+                   '4': '....-', '5': '.....', '6': '-....', '7': '--...', '8': '---..',
+                   '9': '----.', '0': '-----', ', ': '--..--', '.': '.-.-.-', '?': '..--..',
+                   '/': '-..-.', '-': '-....-', '(': '-.--.', ')': '-.--.-'}
+MORSE_DECODE = {code: char for char, code in MORSE_CODE_DICT.items()}
+
+
+def decode_morse(bits):
+    """Decode the notebook's encoding: '1' a dot, '11' a dash, '0' between
+    elements, '00' between letters, '000' between words."""
+    bits = str(bits).strip('0')
+    words = []
+    for word in bits.split('000'):
+        letters = []
+        for letter in word.split('00'):
+            code = ''.join('-' if e == '11' else '.' for e in letter.split('0'))
+            letters.append(MORSE_DECODE.get(code, '?'))
+        words.append(''.join(letters))
+    return ' '.join(words)
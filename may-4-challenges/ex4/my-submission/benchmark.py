@@ -0,0 +1,195 @@
+"""Benchmark the decomposition strategies on a generated corpus of targets.
+
+For every target and strategy the harness records cost, cx/u3 counts,
+spectral-norm error, wall time and peak traced memory, one JSON object per
+line.  tracemalloc slows allocation-heavy strategies several times over, so
+the time comes from an untraced run and the memory from a second, traced
+one; ``--no-memory`` skips the second run.  Passing ``--baseline`` compares
+against an earlier run and exits non-zero on regressions, so it can gate CI.
+
+    python benchmark.py --min-qubits 2 --max-qubits 5 -o bench.jsonl
+    python benchmark.py -o new.jsonl --baseline bench.jsonl
+"""
+import argparse
+import importlib
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import search
+from synthesis import fwht
+
+KINDS = ('hadamard_diagonal', 'block_diagonal', 'haar', 'permutation')
+
+# largest register each strategy is run on; beyond that it is too slow to be
+# worth measuring on every run
+MAX_QUBITS = {
+    'hadamard_diagonal': 8,
+    'structured': 6,
+    'numerical': 2,
+    'qiskit_diagonal': 6,
+    'qiskit_iso': 5,
+}
+
+
+def haar_unitary(dim, rng):
+    z = (rng.standard_normal((dim, dim)) + 1j * rng.standard_normal((dim, dim))) / np.sqrt(2)
+    q, r = np.linalg.qr(z)
+    d = np.diagonal(r)
+    return q * (d / np.abs(d))
+
+
+def _sparse_phases(dim, rng):
+    """Diagonal phases with a few pi/4-multiple Walsh terms, like the
+    challenge unitary, plus noise well inside the error budget."""
+    coeffs = np.zeros(dim)
+    terms = rng.choice(dim, size=min(dim, dim.bit_length() + 1), replace=False)
+    coeffs[terms] = rng.integers(-3, 4, size=len(terms)) * np.pi / 8
+    return fwht(coeffs) + rng.normal(0, 1e-4, dim)
+
+
+def make_target(kind, num_qubits, rng):
+    dim = 2 ** num_qubits
+    if kind == 'hadamard_diagonal':
+        H = fwht(np.eye(dim)) / np.sqrt(dim)
+        return H @ np.diag(np.exp(1j * _sparse_phases(dim, rng))) @ H
+    if kind == 'block_diagonal':
+        # like the embedded ``unitary``: two nearly diagonal blocks with
+        # pi/4-multiple phases, and a dense block in place of one of them
+        half = dim // 2
+        U = np.zeros((dim, dim), dtype=complex)
+        U[:half, :half] = np.diag(np.exp(1j * np.pi / 4 * rng.integers(0, 8, half)))
+        U[half:, half:] = haar_unitary(half, rng)
+        return U
+    if kind == 'haar':
+        return haar_unitary(dim, rng)
+    if kind == 'permutation':
+        perm = rng.permutation(dim)
+        return np.eye(dim)[:, perm] * np.exp(1j * np.pi / 4 * rng.integers(0, 8, dim))
+    raise ValueError('unknown target kind %r' % kind)
+
+
+def corpus(min_qubits=2, max_qubits=8, kinds=KINDS, seed=0):
+    """Yield ``(name, kind, num_qubits, U)``; the same seed gives the same
+    targets, so runs are comparable."""
+    rng = np.random.default_rng(seed)
+    for n in range(min_qubits, max_qubits + 1):
+        for kind in kinds:
+            yield '%s-%d' % (kind, n), kind, n, make_target(kind, n, rng)
+
+
+def measure(strategy, options, U, eps, memory=True):
+    """Run one strategy in-process and return its record.  ``seconds`` is
+    from an untraced run; with ``memory`` a traced rerun gives
+    ``peak_bytes`` (``None`` otherwise)."""
+    start = time.perf_counter()
+    attempt = search.run_strategy(strategy, options, U, eps)
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            search.run_strategy(strategy, options, U, eps)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    counts = attempt.circuit.count_ops() if attempt.circuit is not None else {}
+    return {
+        'strategy': strategy,
+        'options': options,
+        'cost': attempt.cost if attempt.circuit is not None else None,
+        'cx': counts.get('cx'),
+        'u3': counts.get('u3'),
+        'error': attempt.error if attempt.circuit is not None else None,
+        'passed': attempt.circuit is not None and attempt.error <= eps,
+        'seconds': seconds,
+        'peak_bytes': peak,
+        'failure': attempt.failure,
+    }
+
+
+def run(targets, strategies=None, eps=0.01, out=sys.stdout, memory=True):
+    """Benchmark every strategy on every target, writing records to ``out``
+    as they finish; returns the records."""
+    if strategies is None:
+        strategies = [('hadamard_diagonal', {}), ('structured', {}), ('numerical', {'seed': 0}),
+                      ('qiskit_diagonal', {'optimization_level': 3, 'seed': 0}),
+                      ('qiskit_iso', {'optimization_level': 2, 'seed': 0})]
+    # pay the scipy import before the first timed strategy does
+    importlib.import_module('scipy.linalg')
+
+    records = []
+    for name, kind, n, U in targets:
+        for strategy, options in strategies:
+            if n > MAX_QUBITS.get(strategy, n):
+                continue
+            record = dict(target=name, kind=kind, num_qubits=n, **measure(strategy, options, U, eps, memory))
+            records.append(record)
+            out.write(json.dumps(record) + '\n')
+            out.flush()
+    return records
+
+
+def _record_key(record):
+    return record['target'], record['strategy'], json.dumps(record['options'], sort_keys=True)
+
+
+def regressions(records, baseline, cost_tol=0.0, time_tol=2.0):
+    """Messages for records that got worse than ``baseline``: higher cost,
+    a lost pass, or wall time above ``time_tol`` times the old one."""
+    old = {_record_key(r): r for r in baseline}
+    found = []
+    for r in records:
+        b = old.get(_record_key(r))
+        if b is None:
+            continue
+        label = '%s / %s %s' % (r['target'], r['strategy'], r['options'])
+        if b['passed'] and not r['passed']:
+            found.append('%s: no longer passes (%s)' % (label, r['failure'] or 'error %.3g' % r['error']))
+        elif b['passed'] and r['cost'] > b['cost'] * (1 + cost_tol):
+            found.append('%s: cost %d -> %d' % (label, b['cost'], r['cost']))
+        if r['seconds'] > b['seconds'] * time_tol and r['seconds'] > 0.05:
+            found.append('%s: time %.3fs -> %.3fs' % (label, b['seconds'], r['seconds']))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--min-qubits', type=int, default=2)
+    parser.add_argument('--max-qubits', type=int, default=8)
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=list(KINDS))
+    parser.add_argument('--strategies', nargs='+', choices=sorted(search.STRATEGIES),
+                        help='run these with default options')
+    parser.add_argument('--eps', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='JSON lines file (default: stdout)')
+    parser.add_argument('--baseline', help='earlier output to check for regressions')
+    parser.add_argument('--cost-tol', type=float, default=0.0)
+    parser.add_argument('--time-tol', type=float, default=2.0)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the traced rerun that measures peak memory')
+    args = parser.parse_args(argv)
+
+    strategies = [(s, {}) for s in args.strategies] if args.strategies else None
+    targets = corpus(args.min_qubits, args.max_qubits, args.kinds, args.seed)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        records = run(targets, strategies, args.eps, out, not args.no_memory)
+    finally:
+        if args.output:
+            out.close()
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = [json.loads(line) for line in f if line.strip()]
+        found = regressions(records, baseline, args.cost_tol, args.time_tol)
+        for message in found:
+            print('REGRESSION', message, file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
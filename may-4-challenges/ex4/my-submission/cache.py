@@ -0,0 +1,170 @@
+"""Disk-backed, content-addressed cache of decomposition results.
+
+Entries are JSON files named by a SHA-256 over a canonical form of the
+target (unitary up to global phase, or circuit QASM), the parameters that
+affect the result (basis gates, optimization level, seed, strategy, etc.) and
+``CACHE_VERSION``, so entries from older code are never served.
+Writes go through a temporary file and ``os.replace`` so readers never see a
+partial entry, reads refresh the file's mtime, and when the directory grows
+past ``max_bytes`` the least recently used entries are evicted under an
+exclusive lock, so several processes can share one cache directory.
+
+    cache = DecompositionCache()
+    key = cache.key(U, strategy='structured', basis_gates=['u3', 'cx'])
+    circuit = cache.get_or_compute(key, lambda: synthesize(U))
+"""
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from circuit import Circuit
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; eviction is then unlocked
+    fcntl = None
+
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'may4-ex4')
+BASIS_GATES = ['u3', 'cx']
+
+# part of every key: bump it whenever a strategy, the peephole pass or the
+# entry format changes what a key should map to
+CACHE_VERSION = 1
+
+
+def canonical_unitary(U, decimals=9):
+    """``U`` with its global phase fixed and rounded to ``decimals``, as
+    integers so the bytes hash the same on every platform."""
+    U = np.asarray(U, dtype=complex)
+    flat = U.ravel()
+    # the first entry within rounding of the largest magnitude is made real
+    mags = np.round(np.abs(flat), decimals)
+    pivot = flat[int(np.argmax(mags))]
+    if abs(pivot) > 0:
+        U = U * (abs(pivot) / pivot)
+    return np.round(np.stack([U.real, U.imag]) * 10 ** decimals).astype(np.int64)
+
+
+class DecompositionCache:
+    """A size-bounded LRU cache of ``Circuit`` results in directory ``path``
+    (``$MAY4_EX4_CACHE`` or ``~/.cache/may4-ex4`` by default)."""
+
+    def __init__(self, path=None, max_bytes=64 * 2 ** 20):
+        self.path = path or os.environ.get('MAY4_EX4_CACHE', DEFAULT_DIR)
+        self.max_bytes = max_bytes
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def key(target, **params):
+        """Hash of ``target`` (a unitary, a qiskit circuit or a ``Circuit``)
+        together with ``params`` and ``CACHE_VERSION``; ``basis_gates``
+        defaults to u3/cx."""
+        params.setdefault('basis_gates', BASIS_GATES)
+        h = hashlib.sha256(b'v%d\0' % CACHE_VERSION)
+        if hasattr(target, 'qasm'):
+            h.update(b'circuit\0' + target.qasm().encode())
+        else:
+            canon = canonical_unitary(target)
+            h.update(b'unitary\0' + repr(canon.shape).encode() + canon.tobytes())
+        h.update(json.dumps(params, sort_keys=True, default=repr).encode())
+        return h.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    def get(self, key):
+        """The cached entry as a dict with a ``circuit`` item, or ``None``."""
+        path = self._file(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        gates = [(name, tuple(qubits), tuple(params)) for name, qubits, params in entry['gates']]
+        entry['circuit'] = Circuit(entry.pop('num_qubits'), gates)
+        del entry['gates']
+        return entry
+
+    def put(self, key, circuit, **meta):
+        """Store ``circuit`` (plus JSON-serialisable ``meta``) under ``key``."""
+        entry = dict(meta, num_qubits=circuit.num_qubits, gates=circuit.gates,
+                     cost=circuit.cost())
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp, self._file(key))
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    def get_or_compute(self, key, compute, **meta):
+        entry = self.get(key)
+        if entry is not None:
+            return entry['circuit']
+        circuit = compute()
+        if circuit is not None:
+            self.put(key, circuit, **meta)
+        return circuit
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(os.path.join(self.path, '.lock'), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _entries(self):
+        entries = []
+        for e in os.scandir(self.path):
+            if e.name.endswith('.json'):
+                with contextlib.suppress(FileNotFoundError):
+                    st = e.stat()
+                    entries.append((st.st_mtime, st.st_size, e.path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits."""
+        with self._locked():
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                total -= size
+
+    def clear(self):
+        with self._locked():
+            for _, _, path in self._entries():
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+
+
+def cached_transpile(qc, cache, optimization_level=3, seed=None):
+    """``transpile`` to u3/cx through ``cache``; returns a ``Circuit``."""
+    key = cache.key(qc, optimization_level=optimization_level, seed=seed)
+
+    def compute():
+        from qiskit.compiler import transpile
+
+        return Circuit.from_qiskit(transpile(qc, basis_gates=BASIS_GATES,
+                                             optimization_level=optimization_level,
+                                             seed_transpiler=seed))
+
+    return cache.get_or_compute(key, compute)
@@ -0,0 +1,122 @@
+"""A minimal u3/cx gate list used by the local decomposition tools.
+
+Qubit ``q`` acts on bit ``q`` of the basis index (qiskit's little-endian
+ordering), so ``Circuit.to_matrix()`` agrees with ``qi.Operator(qc)``.
+"""
+import numpy as np
+
+from verify import circuit_unitary
+
+
+def u3_matrix(theta, phi, lam):
+    """The 2x2 matrix of qiskit's ``u3(theta, phi, lam)``."""
+    c, s = np.cos(theta / 2), np.sin(theta / 2)
+    return np.array([[c, -np.exp(1j * lam) * s],
+                     [np.exp(1j * phi) * s, np.exp(1j * (phi + lam)) * c]])
+
+
+def u3_params(m):
+    """Angles ``(theta, phi, lam)`` of a u3 equal to the 2x2 unitary ``m`` up
+    to a global phase."""
+    c, s = abs(m[0, 0]), abs(m[1, 0])
+    theta = 2 * np.arctan2(s, c)
+    if c < 1e-12:
+        g = np.angle(-m[0, 1])
+        return theta, float(np.angle(m[1, 0]) - g), 0.0
+    g = np.angle(m[0, 0])
+    if s < 1e-12:
+        return theta, 0.0, float(np.angle(m[1, 1]) - g)
+    phi = np.angle(m[1, 0]) - g
+    return theta, float(phi), float(np.angle(-m[0, 1]) - g)
+
+
+class Circuit:
+    """An ordered list of ``('u3', (q,), (theta, phi, lam))`` and
+    ``('cx', (control, target), ())`` gates on ``num_qubits`` qubits."""
+
+    def __init__(self, num_qubits, gates=None):
+        self.num_qubits = num_qubits
+        self.gates = list(gates) if gates else []
+
+    def __len__(self):
+        return len(self.gates)
+
+    def __iter__(self):
+        return iter(self.gates)
+
+    def copy(self):
+        return Circuit(self.num_qubits, self.gates)
+
+    def u3(self, theta, phi, lam, qubit):
+        self.gates.append(('u3', (qubit,), (float(theta), float(phi), float(lam))))
+
+    def cx(self, control, target):
+        self.gates.append(('cx', (control, target), ()))
+
+    def h(self, qubit):
+        self.u3(np.pi / 2, 0, np.pi, qubit)
+
+    def x(self, qubit):
+        self.u3(np.pi, 0, np.pi, qubit)
+
+    def rz(self, lam, qubit):
+        # equal to Rz(lam) up to a global phase
+        self.u3(0, 0, lam, qubit)
+
+    def ry(self, theta, qubit):
+        self.u3(theta, 0, 0, qubit)
+
+    def unitary1q(self, m, qubit):
+        self.u3(*u3_params(m), qubit)
+
+    def extend(self, other):
+        self.gates.extend(other.gates)
+        return self
+
+    def count_ops(self):
+        counts = {}
+        for name, _, _ in self.gates:
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def cost(self):
+        """The challenge cost ``10 * n_cx + n_u3``."""
+        counts = self.count_ops()
+        return 10 * counts.get('cx', 0) + counts.get('u3', 0)
+
+    def to_matrix(self):
+        return circuit_unitary(self)
+
+    def qasm(self):
+        lines = ['OPENQASM 2.0;', 'include "qelib1.inc";', 'qreg q[%d];' % self.num_qubits]
+        for name, qubits, params in self.gates:
+            if name == 'u3':
+                lines.append('u3(%r,%r,%r) q[%d];' % (params + qubits))
+            else:
+                lines.append('cx q[%d],q[%d];' % qubits)
+        return '\n'.join(lines) + '\n'
+
+    def to_qiskit(self):
+        from qiskit import QuantumCircuit
+
+        qc = QuantumCircuit(self.num_qubits)
+        for name, qubits, params in self.gates:
+            if name == 'u3':
+                qc.u3(*params, qubits[0])
+            else:
+                qc.cx(*qubits)
+        return qc
+
+    @classmethod
+    def from_qiskit(cls, qc):
+        """Read a circuit that has already been unrolled to u3/cx."""
+        circuit = cls(qc.num_qubits)
+        for instr, qargs, _ in qc.data:
+            qubits = tuple(qc.qubits.index(q) for q in qargs)
+            if instr.name == 'u3':
+                circuit.u3(*[float(p) for p in instr.params], qubits[0])
+            elif instr.name == 'cx':
+                circuit.cx(*qubits)
+            elif instr.name != 'barrier':
+                raise ValueError("gate '%s' is not in the u3/cx basis" % instr.name)
+        return circuit
@@ -0,0 +1,207 @@
+"""Decompose a stream of unitaries into u3/cx circuits from the command line.
+
+Targets come from ``.npy`` files (one matrix or a ``(K, N, N)`` stack,
+memory-mapped), ``.npz`` archives (every array in them) or stdin, which takes
+either raw ``.npy``/``.npz`` bytes or JSON lines such as
+``{"name": "U", "real": [[...]], "imag": [[...]]}``.  Each target is searched
+in a worker process, and a JSON line with its QASM, cost, cx/u3 counts and
+error is written as soon as it finishes.  Only a few targets per worker are
+in flight at once, so inputs of any size stream through in bounded memory.
+
+The search modules (and scipy/qiskit behind them) are imported inside the
+workers, so the command starts in the time it takes to import numpy.
+
+    python decompose.py targets.npy --eps 0.01 -o circuits.jsonl
+    python decompose.py - --strategies hadamard_diagonal structured < targets.jsonl
+
+A target that cannot be read or searched (a malformed JSON line, a matrix
+that is not ``2^n x 2^n``, a strategy that raises) gets a record with
+``"passed": false`` and an ``exception`` message, and the batch carries on.
+Exits with 1 if any target could not be decomposed within ``--eps``.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+
+def _stack(name, array):
+    """Yield ``(name, U)`` for one matrix or each matrix of a stack."""
+    if array.ndim == 2:
+        yield name, array
+    elif array.ndim == 3:
+        for i in range(len(array)):
+            yield '%s[%d]' % (name, i), array[i]
+    else:
+        raise ValueError('%s: expected an (N, N) or (K, N, N) array, got shape %s'
+                         % (name, array.shape))
+
+
+def _archive(name, source):
+    with np.load(source) as archive:
+        for key in archive.files:
+            try:
+                yield from _stack('%s:%s' % (name, key), archive[key])
+            except ValueError as error:
+                yield '%s:%s' % (name, key), error
+
+
+def _json_lines(lines):
+    for i, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        name = 'stdin:%d' % i
+        try:
+            record = json.loads(line)
+            name = record.get('name', name)
+            U = np.asarray(record['real'], dtype=float) + 1j * np.asarray(record.get('imag', 0.0))
+            targets = list(_stack(name, U))
+        except (ValueError, TypeError, KeyError, AttributeError) as error:
+            yield name, error
+            continue
+        yield from targets
+
+
+def _source(path, stdin):
+    if path == '-':
+        stream = (stdin or sys.stdin).buffer
+        head = stream.peek(6)[:6] if hasattr(stream, 'peek') else b''
+        if head.startswith(b'\x93NUMPY') or head.startswith(b'PK'):
+            data = io.BytesIO(stream.read())
+            if head.startswith(b'PK'):
+                yield from _archive('stdin', data)
+            else:
+                yield from _stack('stdin', np.load(data))
+        else:
+            yield from _json_lines(io.TextIOWrapper(stream))
+    elif path.endswith('.npz'):
+        yield from _archive(path, path)
+    else:
+        yield from _stack(path, np.load(path, mmap_mode='r'))
+
+
+def read_targets(paths, stdin=None):
+    """Yield ``(name, U)`` for every target in ``paths`` (``'-'`` is stdin).
+    A source or JSON line that cannot be read yields ``(name, exception)``
+    instead, and reading goes on with the next one."""
+    for path in paths:
+        try:
+            yield from _source(path, stdin)
+        except (OSError, ValueError, EOFError) as error:
+            yield path, error
+
+
+def failure(name, error):
+    """The record of a target that could not be read or searched."""
+    return {'name': name, 'passed': False, 'error': None,
+            'exception': '%s: %s' % (type(error).__name__, error)}
+
+
+def decompose(name, U, eps, strategies=None, target_cost=None, cache_dir=None):
+    """Search one target in-process and return its JSON record; an
+    exception becomes a ``failure`` record instead of ending the batch."""
+    try:
+        return _decompose(name, U, eps, strategies, target_cost, cache_dir)
+    except Exception as error:
+        return failure(name, error)
+
+
+def _decompose(name, U, eps, strategies, target_cost, cache_dir):
+    import search
+    from synthesis import num_qubits_of
+
+    num_qubits = num_qubits_of(U)
+    cache = None
+    if cache_dir is not None:
+        from cache import DecompositionCache
+
+        cache = DecompositionCache(cache_dir)
+    start = time.perf_counter()
+    if strategies is not None:
+        strategies = [(s, {}) for s in strategies]
+    result = search.search(U, eps, strategies, target_cost, max_workers=1, cache=cache)
+    record = {'name': name, 'num_qubits': num_qubits,
+              'passed': result.circuit is not None, 'seconds': time.perf_counter() - start}
+    if result.circuit is not None:
+        counts = result.circuit.count_ops()
+        record.update(cost=result.cost, cx=counts.get('cx', 0), u3=counts.get('u3', 0),
+                      error=result.error, strategy=result.strategy, options=result.options,
+                      qasm=result.circuit.qasm())
+    else:
+        error = min((a.error for a in result.attempts), default=np.inf)
+        record.update(error=error if np.isfinite(error) else None,
+                      failures=sorted({a.failure for a in result.attempts if a.failure}))
+    return record
+
+
+def run(targets, out, eps=0.01, strategies=None, target_cost=None, cache_dir=None,
+        max_workers=None, in_flight=2):
+    """Decompose ``targets`` on a process pool with at most ``in_flight``
+    targets per worker queued, writing records to ``out`` as they finish.
+    Returns the number of targets that did not pass."""
+    max_workers = max_workers or os.cpu_count() or 1
+    failed = 0
+
+    def emit(record):
+        nonlocal failed
+        failed += not record['passed']
+        out.write(json.dumps(record, default=repr) + '\n')
+        out.flush()
+
+    def collect(future):
+        name = names.pop(future)
+        try:
+            record = future.result()
+        except Exception as error:  # the worker itself died
+            record = failure(name, error)
+        emit(record)
+
+    names = {}
+    with ProcessPoolExecutor(max_workers) as pool:
+        for name, U in targets:
+            if isinstance(U, Exception):
+                emit(failure(name, U))
+                continue
+            if len(names) >= max_workers * in_flight:
+                done, _ = wait(names, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+            # copy out of a memory map so only this target is pickled
+            U = np.array(U, dtype=complex)
+            names[pool.submit(decompose, name, U, eps, strategies, target_cost, cache_dir)] = name
+        for future in wait(names).done:
+            collect(future)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', nargs='*', default=['-'],
+                        help='.npy or .npz files, or - for stdin (default)')
+    parser.add_argument('--eps', type=float, default=0.01)
+    parser.add_argument('--strategies', nargs='+',
+                        help='strategy names from search.STRATEGIES, run with default options '
+                             '(default: search.default_strategies)')
+    parser.add_argument('--target-cost', type=float, help='stop a search at this cost')
+    parser.add_argument('--cache', help='DecompositionCache directory shared by the workers')
+    parser.add_argument('-j', '--workers', type=int, help='worker processes (default: CPU count)')
+    parser.add_argument('-o', '--output', help='JSON lines file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        failed = run(read_targets(args.inputs), out, args.eps, args.strategies, args.target_cost,
+                     args.cache, args.workers)
+    finally:
+        if args.output:
+            out.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""Numerical synthesis for unitaries without exploitable structure.
+
+A fixed u3/cx template (a u3 on every qubit, then ``num_cx`` blocks of
+``cx`` followed by a u3 on both of its qubits) is fitted to ``U`` by
+maximising the phase-invariant fidelity ``|tr(U^dag V)|^2 / N^2``.  Gradients
+are analytic: one forward sweep stores the partial products in front of each
+u3, one backward sweep builds the environment of each gate, and the
+derivative of a u3 is contracted against the environment's partial trace.
+Every restart runs in the same NumPy batch.  ``compile_unitary`` walks the
+CX count upwards until the spectral-norm target is met.
+"""
+import itertools
+
+import numpy as np
+
+import verify
+from circuit import Circuit
+
+
+def template(num_qubits, num_cx, pairs=None):
+    """The ansatz with placeholder angles; ``pairs`` are the cx
+    ``(control, target)`` pairs cycled through (every pair by default)."""
+    if pairs is None:
+        pairs = list(itertools.combinations(range(num_qubits), 2))
+    circuit = Circuit(num_qubits)
+    for q in range(num_qubits):
+        circuit.u3(0, 0, 0, q)
+    for k in range(num_cx):
+        c, t = pairs[k % len(pairs)]
+        circuit.cx(c, t)
+        circuit.u3(0, 0, 0, c)
+        circuit.u3(0, 0, 0, t)
+    return circuit
+
+
+def with_params(circuit, params):
+    """``circuit`` with its u3 angles replaced by the rows of ``params``."""
+    rows = iter(params)
+    gates = [(name, qubits, tuple(float(p) for p in next(rows)) if name == 'u3' else ())
+             for name, qubits, _ in circuit.gates]
+    return Circuit(circuit.num_qubits, gates)
+
+
+def _u3_derivatives(params):
+    """``d u3 / d(theta, phi, lam)`` as an array of shape ``(..., 3, 2, 2)``."""
+    theta, phi, lam = params[..., 0], params[..., 1], params[..., 2]
+    c, s = np.cos(theta / 2), np.sin(theta / 2)
+    ep, el, epl = np.exp(1j * phi), np.exp(1j * lam), np.exp(1j * (phi + lam))
+    d = np.zeros(params.shape[:-1] + (3, 2, 2), dtype=complex)
+    d[..., 0, 0, 0] = -s / 2
+    d[..., 0, 0, 1] = -el * c / 2
+    d[..., 0, 1, 0] = ep * c / 2
+    d[..., 0, 1, 1] = -epl * s / 2
+    d[..., 1, 1, 0] = 1j * ep * s
+    d[..., 1, 1, 1] = 1j * epl * c
+    d[..., 2, 0, 1] = -1j * el * s
+    d[..., 2, 1, 1] = 1j * epl * c
+    return d
+
+
+def _partial_trace(E, qubit):
+    """``E'[b, a] = sum_rest E[(b, rest), (a, rest)]`` for each batch item."""
+    B, dim = E.shape[0], E.shape[1]
+    hi, lo = dim >> (qubit + 1), 1 << qubit
+    return np.einsum('zhblhal->zba', E.reshape(B, hi, 2, lo, hi, 2, lo))
+
+
+def loss_and_grad(U, circuit, params):
+    """Infidelity ``1 - |tr(U^dag V)|^2 / N^2`` and its gradient for a batch
+    of angle sets ``params`` of shape ``(B, n_u3, 3)``."""
+    n = circuit.num_qubits
+    dim = 2 ** n
+    B = len(params)
+    mats = verify.u3_matrices(params)
+    ops = np.broadcast_to(np.eye(dim, dtype=complex), (B, dim, dim)).copy()
+    prefixes = []
+    k = 0
+    for name, qubits, _ in circuit.gates:
+        if name == 'u3':
+            prefixes.append(ops.copy())
+            verify.apply_1q(ops, mats[:, k], qubits[0])
+            k += 1
+        else:
+            verify.apply_cx(ops, *qubits)
+    trace = np.einsum('ij,zij->z', np.conj(U), ops)
+
+    # AT is the transpose of U^dag . (gates after the current one)
+    AT = np.broadcast_to(np.conj(U), (B, dim, dim)).copy()
+    dT = np.empty(params.shape, dtype=complex)
+    derivs = _u3_derivatives(params)
+    for name, qubits, _ in reversed(circuit.gates):
+        if name == 'u3':
+            k -= 1
+            env = prefixes[k] @ np.swapaxes(AT, 1, 2)
+            reduced = _partial_trace(env, qubits[0])
+            dT[:, k] = np.einsum('zpab,zba->zp', derivs[:, k], reduced)
+            verify.apply_1q(AT, np.swapaxes(mats[:, k], 1, 2), qubits[0])
+        else:
+            verify.apply_cx(AT, *qubits)
+    fidelity = np.abs(trace) ** 2 / dim ** 2
+    grad = -2 * np.real(np.conj(trace)[:, None, None] * dT) / dim ** 2
+    return 1 - fidelity, grad
+
+
+def fit(U, circuit, restarts=32, steps=2000, lr=0.05, eps=0.01, seed=None, check_every=50,
+        patience=4):
+    """Fit the angles of ``circuit`` to ``U`` with batched Adam.
+
+    Returns ``(params, error)`` for the restart with the smallest spectral
+    error.  Stops early once any restart is within ``eps``, or when the best
+    infidelity has not dropped by 1% for ``patience`` checks, which is what a
+    CX count that is too small looks like.
+    """
+    rng = np.random.default_rng(seed)
+    n_u3 = circuit.count_ops().get('u3', 0)
+    params = rng.uniform(-np.pi, np.pi, (restarts, n_u3, 3))
+    m = np.zeros_like(params)
+    v = np.zeros_like(params)
+    beta1, beta2 = 0.9, 0.999
+    best = (None, np.inf)
+    best_loss, stalled = np.inf, 0
+    for step in range(1, steps + 1):
+        loss, grad = loss_and_grad(U, circuit, params)
+        m = beta1 * m + (1 - beta1) * grad
+        v = beta2 * v + (1 - beta2) * grad ** 2
+        params -= lr * (m / (1 - beta1 ** step)) / (np.sqrt(v / (1 - beta2 ** step)) + 1e-12)
+        if step % check_every == 0 or step == steps:
+            errs, _ = verify.score_template(U, circuit, params)
+            i = int(np.argmin(errs))
+            if errs[i] < best[1]:
+                best = (params[i].copy(), float(errs[i]))
+            if best[1] <= eps:
+                break
+            stalled = stalled + 1 if loss.min() > 0.99 * best_loss else 0
+            best_loss = min(best_loss, loss.min())
+            if stalled >= patience:
+                break
+    return best
+
+
+def _refine(U, circuit, params):
+    """Polish one angle set with L-BFGS on the same analytic gradient."""
+    from scipy.optimize import minimize
+
+    shape = (1,) + params.shape
+
+    def fun(x):
+        loss, grad = loss_and_grad(U, circuit, x.reshape(shape))
+        return loss[0], grad.ravel()
+
+    res = minimize(fun, params.ravel(), jac=True, method='L-BFGS-B')
+    return res.x.reshape(params.shape)
+
+
+def shannon_lower_bound(num_qubits):
+    """CNOTs needed for a generic n-qubit unitary: ceil((4^n - 3n - 1) / 4)."""
+    return -(-(4 ** num_qubits - 3 * num_qubits - 1) // 4)
+
+
+def compile_unitary(U, eps=0.01, min_cx=0, max_cx=None, step=1, pairs=None, **fit_options):
+    """Search upwards over the CX count for a template that meets ``eps``.
+
+    Returns the first ``Circuit`` within ``eps`` (spectral norm, up to global
+    phase), or ``None`` if ``max_cx`` (default: the generic lower bound plus
+    ``num_qubits``) is reached first.  ``fit_options`` go to ``fit``.
+    """
+    U = np.asarray(U, dtype=complex)
+    n = U.shape[0].bit_length() - 1
+    if max_cx is None:
+        max_cx = shannon_lower_bound(n) + n
+    for num_cx in range(min_cx, max_cx + 1, step):
+        circuit = template(n, num_cx, pairs)
+        params, err = fit(U, circuit, eps=eps, **fit_options)
+        if err > eps:
+            params = _refine(U, circuit, params)
+            err = float(verify.errors(U, verify.template_unitaries(circuit, params[None]))[0])
+        if err <= eps:
+            return with_params(circuit, params)
+    return None
@@ -0,0 +1,99 @@
+"""A single-sweep peephole optimizer for u3/cx circuits.
+
+One pass over the gate list, with O(1) work per gate:
+
+- runs of u3 gates on a qubit are fused by multiplying unit quaternions
+  (SU(2) elements ``w I - i (x X + y Y + z Z)``), and a product that is the
+  identity is dropped;
+- a pending diagonal rotation on a cx control, or an x rotation on its
+  target, is carried past the cx instead of being emitted in front of it;
+- a cx directly following the same cx on both qubits cancels, and any u3
+  that the cancellation brings back to the front is fused again.
+
+It is a cheap stand-in for ``transpile(..., optimization_level=3)`` inside
+search loops, not a replacement for resynthesis.
+"""
+import numpy as np
+
+from circuit import Circuit, u3_params
+
+TOL = 1e-10
+
+
+def quaternion(theta, phi, lam):
+    """Unit quaternion ``(w, x, y, z)`` of u3 up to its global phase, as the
+    closed-form product ``Rz(phi) Ry(theta) Rz(lam)``."""
+    c, s = np.cos(theta / 2), np.sin(theta / 2)
+    p, m = (phi + lam) / 2, (phi - lam) / 2
+    return np.array([c * np.cos(p), -s * np.sin(m), s * np.cos(m), c * np.sin(p)])
+
+
+def multiply(a, b):
+    """The quaternion of ``a . b`` (``b`` is applied first)."""
+    w1, v1 = a[0], a[1:]
+    w2, v2 = b[0], b[1:]
+    return np.concatenate(([w1 * w2 - v1 @ v2], w1 * v2 + w2 * v1 + np.cross(v1, v2)))
+
+
+def to_u3(q):
+    w, x, y, z = q
+    return u3_params(np.array([[w - 1j * z, -1j * x - y], [-1j * x + y, w + 1j * z]]))
+
+
+def _is_identity(q):
+    return 1 - abs(q[0]) < TOL
+
+
+def _is_diagonal(q):
+    return abs(q[1]) < TOL and abs(q[2]) < TOL
+
+
+def _is_x_rotation(q):
+    return abs(q[2]) < TOL and abs(q[3]) < TOL
+
+
+def optimize(circuit):
+    """Return an equivalent (up to global phase) ``Circuit`` with fused u3s,
+    cancelled cx pairs and diagonals commuted through cx controls."""
+    n = circuit.num_qubits
+    out = []
+    last = [[] for _ in range(n)]      # indices into out touching each qubit
+    pending = [None] * n               # fused, not yet emitted, u3 per qubit
+
+    def flush(q):
+        if pending[q] is not None and not _is_identity(pending[q]):
+            last[q].append(len(out))
+            out.append(('u3', (q,), tuple(float(p) for p in to_u3(pending[q]))))
+        pending[q] = None
+
+    def unflush(q):
+        # after a cancellation the u3 in front of it can fuse with what follows
+        if last[q] and out[last[q][-1]][0] == 'u3':
+            i = last[q].pop()
+            earlier = quaternion(*out[i][2])
+            out[i] = None
+            pending[q] = earlier if pending[q] is None else multiply(pending[q], earlier)
+
+    for name, qubits, params in circuit.gates:
+        if name == 'u3':
+            q = qubits[0]
+            g = quaternion(*params)
+            pending[q] = g if pending[q] is None else multiply(g, pending[q])
+            continue
+        c, t = qubits
+        if pending[c] is not None and not _is_diagonal(pending[c]):
+            flush(c)
+        if pending[t] is not None and not _is_x_rotation(pending[t]):
+            flush(t)
+        if last[c] and last[t] and last[c][-1] == last[t][-1] and out[last[c][-1]] == (name, qubits, ()):
+            out[last[c].pop()] = None
+            last[t].pop()
+            unflush(c)
+            unflush(t)
+        else:
+            last[c].append(len(out))
+            last[t].append(len(out))
+            out.append(('cx', (c, t), ()))
+    for q in range(n):
+        flush(q)
+    return Circuit(n, [g for g in out if g is not None])
@@ -0,0 +1,293 @@
+"""Opt-in instrumentation of the decomposition pipeline.
+
+A ``Profiler`` records one entry per stage (``with profiler.stage(name)``)
+and per transpiler pass (``transpile(..., callback=profiler.callback())``).
+Each entry has its wall time, peak traced memory above the start of the
+entry, and, where a circuit is known, the cx/u3 counts and the
+``10 * n_cx + n_u3`` cost after it.  That shows which passes actually lower
+the cost and which only take time.  Entries export to JSON and to the Chrome
+trace format (``chrome://tracing`` or Perfetto), and ``check`` compares them
+with thresholds so regressions can fail a run.
+
+A disabled profiler (the default unless ``$MAY4_EX4_PROFILE`` is set) adds
+no tracing at all: stages are plain context managers and ``callback()`` is
+``None``.
+
+    profiler = Profiler(enabled=True)
+    qc = profile_notebook(U, profiler)            # build, transpile, verify
+    circuit = profile_native(U, profiler)         # synthesize, peephole, verify
+    profiler.save_trace('ex4.trace.json')
+    print(profiler.summary())
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+
+def _counts(circuit):
+    """``(cx, u3)`` of a ``Circuit``, qiskit circuit or DAG."""
+    counts = dict(circuit.count_ops())
+    return counts.get('cx', 0), counts.get('u3', 0)
+
+
+class Profiler:
+    """Collects stage and pass entries; ``enabled=None`` reads
+    ``$MAY4_EX4_PROFILE``.  ``memory=False`` skips tracemalloc, which slows
+    allocation-heavy code down noticeably."""
+
+    def __init__(self, enabled=None, memory=True):
+        if enabled is None:
+            enabled = bool(os.environ.get('MAY4_EX4_PROFILE'))
+        self.enabled = enabled
+        self.memory = memory and enabled
+        self.entries = []
+        self._origin = time.perf_counter()
+        self._stack = []          # open stages: [entry, running peak]
+
+    # -- recording ----------------------------------------------------------
+
+    def _traced(self):
+        return tracemalloc.get_traced_memory() if self.memory else (0, 0)
+
+    def _bubble_peak(self, peak):
+        for frame in self._stack:
+            frame[1] = max(frame[1], peak)
+
+    @contextlib.contextmanager
+    def stage(self, name, **meta):
+        """Time ``name`` and record its peak memory; the yielded entry takes
+        counts through ``profiler.counts(circuit)`` inside the block."""
+        if not self.enabled:
+            yield None
+            return
+        started_tracing = self.memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        current, peak = self._traced()
+        self._bubble_peak(peak)
+        if self.memory:
+            tracemalloc.reset_peak()
+        entry = dict(name=name, kind='stage', parent=self._stack[-1][0]['name'] if self._stack else None,
+                     start=time.perf_counter() - self._origin, **meta)
+        self._stack.append([entry, current])
+        try:
+            yield entry
+        finally:
+            entry['seconds'] = time.perf_counter() - self._origin - entry['start']
+            _, peak = self._traced()
+            frame = self._stack.pop()
+            entry['peak_bytes'] = max(frame[1], peak) - current
+            self._bubble_peak(max(frame[1], peak))
+            self.entries.append(entry)
+            if started_tracing:
+                tracemalloc.stop()
+
+    def counts(self, circuit, entry=None):
+        """Attach cx/u3 counts and cost of ``circuit`` to ``entry`` (the
+        innermost open stage by default)."""
+        if not self.enabled:
+            return
+        entry = entry or self._stack[-1][0]
+        entry['cx'], entry['u3'] = _counts(circuit)
+        entry['cost'] = 10 * entry['cx'] + entry['u3']
+
+    def callback(self):
+        """A ``transpile`` callback that records every pass (its peak
+        memory counts from the end of the previous one), or ``None`` when
+        disabled so transpile runs untouched."""
+        if not self.enabled:
+            return None
+        parent = self._stack[-1][0]['name'] if self._stack else None
+        base = [self._traced()[0]]
+
+        def record(pass_, dag, time, property_set, count, **_):
+            current, peak = self._traced()
+            self._bubble_peak(peak)
+            if self.memory:
+                tracemalloc.reset_peak()
+            cx, u3 = _counts(dag)
+            self.entries.append(dict(name=pass_.name(), kind='pass', parent=parent, index=count,
+                                     start=self._now() - time, seconds=time,
+                                     peak_bytes=max(0, peak - base[0]), cx=cx, u3=u3,
+                                     cost=10 * cx + u3))
+            base[0] = current
+
+        return record
+
+    def _now(self):
+        return time.perf_counter() - self._origin
+
+    # -- reporting ----------------------------------------------------------
+
+    def passes(self):
+        """Pass entries with ``delta_cost``, the change in cost each made."""
+        out, last = [], {}
+        for e in self.entries:
+            if e['kind'] != 'pass':
+                continue
+            e = dict(e, delta_cost=e['cost'] - last.get(e['parent'], e['cost']))
+            last[e['parent']] = e['cost']
+            out.append(e)
+        return out
+
+    def to_json(self):
+        return {'entries': sorted(self.entries, key=lambda e: e['start']), 'passes': self.passes()}
+
+    def save_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_json(), f, indent=1, default=repr)
+
+    def chrome_trace(self):
+        """Trace events: one complete event per entry, and a counter track
+        of cx/u3 after every entry that has counts."""
+        events = []
+        for e in sorted(self.entries, key=lambda e: e['start']):
+            ts = e['start'] * 1e6
+            args = {k: v for k, v in e.items() if k not in ('name', 'start', 'seconds', 'kind')}
+            events.append(dict(name=e['name'], cat=e['kind'], ph='X', ts=ts, dur=e['seconds'] * 1e6,
+                               pid=os.getpid(), tid=0 if e['kind'] == 'stage' else 1, args=args))
+            if 'cx' in e:
+                events.append(dict(name='gates', ph='C', ts=ts + e['seconds'] * 1e6, pid=os.getpid(),
+                                   args={'cx': e['cx'], 'u3': e['u3']}))
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f, default=repr)
+
+    def summary(self):
+        lines = ['%-40s %10s %12s %6s %6s %6s' % ('entry', 'ms', 'peak KiB', 'cx', 'u3', 'cost')]
+        for e in sorted(self.entries, key=lambda e: e['start']):
+            indent = '  ' if e['kind'] == 'pass' or e['parent'] else ''
+            lines.append('%-40s %10.2f %12.1f %6s %6s %6s' % (
+                (indent + e['name'])[:40], e['seconds'] * 1e3, e['peak_bytes'] / 1024,
+                e.get('cx', ''), e.get('u3', ''), e.get('cost', '')))
+        return '\n'.join(lines)
+
+    def check(self, thresholds):
+        """Messages for stages over their thresholds, given as
+        ``{name: {'seconds': s, 'peak_bytes': b, 'cost': c}}``; passes are
+        matched by name as well and checked on their total time."""
+        totals = {}
+        for e in self.entries:
+            t = totals.setdefault(e['name'], {'seconds': 0.0, 'peak_bytes': 0, 'cost': None})
+            t['seconds'] += e['seconds']
+            t['peak_bytes'] = max(t['peak_bytes'], e['peak_bytes'])
+            if 'cost' in e:
+                t['cost'] = e['cost']
+        found = []
+        for name, limits in thresholds.items():
+            if name not in totals:
+                continue
+            for key, limit in limits.items():
+                value = totals[name].get(key)
+                if value is not None and value > limit:
+                    found.append('%s: %s %.4g > %.4g' % (name, key, value, limit))
+        return found
+
+
+_NULL = Profiler(enabled=False)
+
+
+def profile_notebook(U, profiler=_NULL, route='diagonal', optimization_level=3, seed=None,
+                     eps=0.01):
+    """The notebook's route with every stage recorded: build the
+    ``qc.diagonal`` (or ``qc.iso``) circuit, transpile it pass by pass,
+    convert it and verify it.  The circuit is built by
+    ``search.notebook_circuit``, as in the search.  Returns the transpiled
+    circuit, or ``None`` if the route does not apply to ``U``."""
+    import search
+    import verify
+    from circuit import Circuit
+
+    with profiler.stage('import qiskit'):
+        from qiskit.compiler import transpile
+    with profiler.stage('build %s' % route):
+        qc = search.notebook_circuit(U, route)
+    if qc is None:
+        return None
+    with profiler.stage('transpile', optimization_level=optimization_level) as entry:
+        qc = transpile(qc, basis_gates=['u3', 'cx'], optimization_level=optimization_level,
+                       seed_transpiler=seed, callback=profiler.callback())
+        profiler.counts(qc, entry)
+    with profiler.stage('verify') as entry:
+        circuit = Circuit.from_qiskit(qc)
+        passed, err, _ = verify.check(U, circuit, eps)
+        if entry is not None:
+            entry.update(error=err, passed=passed)
+        profiler.counts(circuit)
+    return qc
+
+
+def profile_native(U, profiler=_NULL, strategy='structured', eps=0.01, **options):
+    """One of ``search.STRATEGIES`` split into synthesize, peephole and
+    verify stages, with the counts after each.  Returns the ``Circuit``."""
+    import peephole
+    import search
+    import verify
+
+    with profiler.stage('synthesize %s' % strategy):
+        circuit = search.STRATEGIES[strategy](U, eps, **options)
+        if circuit is None:
+            return None
+        profiler.counts(circuit)
+    with profiler.stage('peephole'):
+        circuit = peephole.optimize(circuit)
+        profiler.counts(circuit)
+    with profiler.stage('verify') as entry:
+        passed, err, _ = verify.check(U, circuit, eps)
+        if entry is not None:
+            entry.update(error=err, passed=passed)
+        profiler.counts(circuit)
+    return circuit
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('target', nargs='?', help='.npy unitary (default: a benchmark target)')
+    parser.add_argument('--kind', default='hadamard_diagonal', help='benchmark target kind')
+    parser.add_argument('--qubits', type=int, default=4)
+    parser.add_argument('--strategies', nargs='+', default=['hadamard_diagonal', 'structured'])
+    parser.add_argument('--notebook', choices=['diagonal', 'iso'],
+                        help='also profile the notebook route through transpile')
+    parser.add_argument('--no-memory', action='store_true', help='skip tracemalloc')
+    parser.add_argument('--json', help='write entries as JSON')
+    parser.add_argument('--trace', help='write a Chrome trace')
+    parser.add_argument('--thresholds', help='JSON {name: {seconds|peak_bytes|cost: limit}}')
+    args = parser.parse_args(argv)
+
+    if args.target:
+        U = np.load(args.target)
+    else:
+        import benchmark
+
+        U = benchmark.make_target(args.kind, args.qubits, np.random.default_rng(0))
+    profiler = Profiler(enabled=True, memory=not args.no_memory)
+    for strategy in args.strategies:
+        with profiler.stage(strategy):
+            profile_native(U, profiler, strategy)
+    if args.notebook:
+        with profiler.stage('notebook %s' % args.notebook):
+            profile_notebook(U, profiler, args.notebook)
+    print(profiler.summary())
+    if args.json:
+        profiler.save_json(args.json)
+    if args.trace:
+        profiler.save_trace(args.trace)
+    if args.thresholds:
+        with open(args.thresholds) as f:
+            found = profiler.check(json.load(f))
+        for message in found:
+            print('THRESHOLD', message, file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""Run several decomposition strategies in parallel and keep the cheapest.
+
+Each strategy is a ``(name, options)`` pair naming a function in
+``STRATEGIES``.  Workers synthesize and verify their circuit locally, so the
+driver only compares ``(error, cost)`` and can stop as soon as a candidate
+that passes the error check beats ``target_cost``; the worker processes are
+then terminated, so strategies still running do not hold on to the cores.
+
+    from search import search
+    best = search(U, eps=0.01, target_cost=100)
+    best.circuit.to_qiskit()
+"""
+import itertools
+import multiprocessing
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import numerical
+import peephole
+import synthesis
+import verify
+from circuit import Circuit
+
+Attempt = namedtuple('Attempt', 'strategy options circuit error cost seconds failure')
+SearchResult = namedtuple('SearchResult', 'circuit error cost strategy options attempts')
+
+
+def permute_qubits(U, perm):
+    """``U`` with local qubit ``j`` relabelled as qubit ``perm[j]``."""
+    n = synthesis.num_qubits_of(U)
+    # tensor axis k holds qubit n - 1 - k
+    order = [n - 1 - perm.index(n - 1 - k) for k in range(n)]
+    T = np.asarray(U).reshape((2,) * (2 * n)).transpose(order + [n + k for k in order])
+    return T.reshape(U.shape)
+
+
+def _relabel(circuit, perm):
+    inverse = [perm.index(q) for q in range(len(perm))]
+    return Circuit(circuit.num_qubits,
+                   [(name, tuple(inverse[q] for q in qubits), params)
+                    for name, qubits, params in circuit.gates])
+
+
+def _with_layout(synthesize):
+    """Let a strategy take ``layout=perm``: synthesize the relabelled
+    operator and map the circuit back, which changes e.g. which qubit the
+    Shannon decomposition multiplexes on."""
+    def run(U, eps, layout=None, **options):
+        if layout is None:
+            return synthesize(U, eps, **options)
+        return _relabel(synthesize(permute_qubits(U, list(layout)), eps, **options), list(layout))
+    run.__name__ = synthesize.__name__
+    return run
+
+
+@_with_layout
+def hadamard_diagonal(U, eps, approximate=True):
+    return synthesis.synthesize_hadamard_diagonal(U, eps, approximate)
+
+
+@_with_layout
+def structured(U, eps):
+    return synthesis.synthesize_structured(U)
+
+
+def _transpile(qc, optimization_level, seed):
+    from qiskit.compiler import transpile
+
+    qc = transpile(qc, basis_gates=['u3', 'cx'], optimization_level=optimization_level,
+                   seed_transpiler=seed)
+    return Circuit.from_qiskit(qc)
+
+
+def notebook_circuit(U, route='diagonal'):
+    """The untranspiled qiskit circuit of one of the notebook's routes:
+    ``'diagonal'`` is ``h``, ``qc.diagonal`` of ``H U H``, ``h``, and
+    ``'iso'`` is generic isometry synthesis.  ``None`` if the diagonal route
+    does not apply (a zero on the diagonal of ``H U H``)."""
+    from qiskit import QuantumCircuit
+
+    n = synthesis.num_qubits_of(U)
+    qc = QuantumCircuit(n)
+    if route == 'iso':
+        qc.iso(np.asarray(U), list(range(n)), [])
+        return qc
+    d = np.diagonal(synthesis.hadamard_conjugate(U))
+    if np.any(np.abs(d) == 0):
+        return None
+    qc.h(range(n))
+    qc.diagonal((d / np.abs(d)).tolist(), list(range(n)))
+    qc.h(range(n))
+    return qc
+
+
+def qiskit_diagonal(U, eps, optimization_level=3, seed=None):
+    """The notebook's route: ``h``, ``qc.diagonal`` of ``H U H``, ``h``."""
+    qc = notebook_circuit(U, 'diagonal')
+    return None if qc is None else _transpile(qc, optimization_level, seed)
+
+
+def qiskit_iso(U, eps, optimization_level=2, seed=None):
+    """Generic isometry synthesis followed by ``transpile``."""
+    return _transpile(notebook_circuit(U, 'iso'), optimization_level, seed)
+
+
+def numerical_fit(U, eps, **options):
+    return numerical.compile_unitary(U, eps, **options)
+
+
+STRATEGIES = {
+    'hadamard_diagonal': hadamard_diagonal,
+    'structured': structured,
+    'qiskit_diagonal': qiskit_diagonal,
+    'qiskit_iso': qiskit_iso,
+    'numerical': numerical_fit,
+}
+
+
+def default_strategies(num_qubits, seeds=(0, 1, 2)):
+    """The native strategies under every qubit layout (up to 4 qubits, else
+    just the identity and reversed layouts), plus the notebook's qiskit
+    routes at both optimization levels and a few transpiler seeds.  The
+    numerical compiler joins in up to 3 qubits, where it is still quick."""
+    if num_qubits <= 4:
+        layouts = [list(p) for p in itertools.permutations(range(num_qubits))]
+    else:
+        layouts = [list(range(num_qubits)), list(range(num_qubits))[::-1]]
+    specs = [('hadamard_diagonal', {'approximate': True}),
+             ('hadamard_diagonal', {'approximate': False})]
+    specs += [('structured', {'layout': p}) for p in layouts]
+    for level, seed in itertools.product((2, 3), seeds):
+        specs.append(('qiskit_diagonal', {'optimization_level': level, 'seed': seed}))
+        specs.append(('qiskit_iso', {'optimization_level': level, 'seed': seed}))
+    if num_qubits <= 3:
+        specs += [('numerical', {'seed': seed}) for seed in seeds]
+    return specs
+
+
+def run_strategy(strategy, options, U, eps, cache=None):
+    """Synthesize, peephole-optimize and verify one candidate; never raises,
+    so one broken strategy (e.g. qiskit missing on a worker) cannot sink the
+    search.
+
+    With a ``DecompositionCache`` the verified circuit is stored under the
+    target, strategy, options and ``eps``, and later runs just read it back.
+    """
+    start = time.perf_counter()
+    try:
+        if cache is not None:
+            key = cache.key(U, strategy=strategy, options=options, eps=eps)
+            entry = cache.get(key)
+            if entry is not None:
+                return Attempt(strategy, options, entry['circuit'], entry['error'],
+                               entry['cost'], time.perf_counter() - start, None)
+        circuit = STRATEGIES[strategy](U, eps, **options)
+        if circuit is None:
+            return Attempt(strategy, options, None, np.inf, np.inf,
+                           time.perf_counter() - start, 'not applicable')
+        circuit = peephole.optimize(circuit)
+        _, err, cost = verify.check(U, circuit, eps)
+        if cache is not None:
+            cache.put(key, circuit, error=err)
+    except Exception as exc:  # noqa: BLE001 - reported in the attempt
+        return Attempt(strategy, options, None, np.inf, np.inf,
+                       time.perf_counter() - start, '%s: %s' % (type(exc).__name__, exc))
+    return Attempt(strategy, options, circuit, err, cost, time.perf_counter() - start, None)
+
+
+def _run_spec(args):
+    return run_strategy(*args)
+
+
+def _better(attempt, best, eps):
+    return attempt.error <= eps and (best is None or attempt.cost < best.cost)
+
+
+def search(U, eps=0.01, strategies=None, target_cost=None, max_workers=None, cache=None):
+    """Run ``strategies`` (default: ``default_strategies``) in a process pool
+    and return the cheapest circuit within ``eps`` as a ``SearchResult``.
+
+    Once a passing candidate costs at most ``target_cost`` the pool is
+    terminated, which cancels the queued strategies and kills the running
+    ones.  ``max_workers=1`` runs everything in-process.
+    ``circuit`` is ``None`` if no strategy met ``eps``.  ``cache`` is an
+    optional ``cache.DecompositionCache`` shared by all workers.
+    """
+    U = np.asarray(U, dtype=complex)
+    if strategies is None:
+        strategies = default_strategies(synthesis.num_qubits_of(U))
+    attempts, best = [], None
+
+    def done(attempt):
+        nonlocal best
+        attempts.append(attempt)
+        if _better(attempt, best, eps):
+            best = attempt
+        return target_cost is not None and best is not None and best.cost <= target_cost
+
+    if max_workers == 1:
+        for strategy, options in strategies:
+            if done(run_strategy(strategy, options, U, eps, cache)):
+                break
+    else:
+        # leaving the block terminates the workers, also those mid-strategy
+        with multiprocessing.Pool(max_workers) as pool:
+            specs = [(strategy, options, U, eps, cache) for strategy, options in strategies]
+            for attempt in pool.imap_unordered(_run_spec, specs):
+                if done(attempt):
+                    break
+    if best is None:
+        return SearchResult(None, np.inf, np.inf, None, None, attempts)
+    return SearchResult(best.circuit, best.error, best.cost, best.strategy, best.options, attempts)
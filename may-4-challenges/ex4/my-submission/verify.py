@@ -0,0 +1,130 @@
+"""Local, batched stand-in for ``check_circuit``.
+
+Unitaries are built by applying each u3/cx gate in place on a strided view of
+a ``(batch, 2^n, 2^n)`` buffer rather than by Kronecker products, and the
+phase-invariant spectral-norm error of a whole batch is a single SVD call.
+The error matches the grader's: the global phase of ``V`` is removed before
+taking ``||U - V||_2``.
+"""
+import numpy as np
+
+
+def u3_matrices(params):
+    """Stacked u3 matrices for ``params[..., :] = (theta, phi, lam)``."""
+    params = np.asarray(params, dtype=float)
+    theta, phi, lam = params[..., 0], params[..., 1], params[..., 2]
+    c, s = np.cos(theta / 2), np.sin(theta / 2)
+    m = np.empty(params.shape[:-1] + (2, 2), dtype=complex)
+    m[..., 0, 0] = c
+    m[..., 0, 1] = -np.exp(1j * lam) * s
+    m[..., 1, 0] = np.exp(1j * phi) * s
+    m[..., 1, 1] = np.exp(1j * (phi + lam)) * c
+    return m
+
+
+def apply_1q(ops, mats, qubit):
+    """``ops[b] <- mats[b] (on qubit) . ops[b]`` in place.
+
+    ``ops`` has shape ``(B, 2^n, M)`` and ``mats`` is ``(2, 2)`` or
+    ``(B, 2, 2)``.  Rows are viewed as ``(high, 2, low)`` so the two halves
+    touched by the gate are plain strided slices.
+    """
+    B, dim, M = ops.shape
+    view = ops.reshape(B, dim >> (qubit + 1), 2, (1 << qubit) * M)
+    mats = np.broadcast_to(mats, (B, 2, 2))[:, :, :, None, None]
+    a0, a1 = view[:, :, 0], view[:, :, 1]
+    tmp = a0.copy()
+    a0 *= mats[:, 0, 0]
+    a0 += mats[:, 0, 1] * a1
+    a1 *= mats[:, 1, 1]
+    a1 += mats[:, 1, 0] * tmp
+    return ops
+
+
+def apply_cx(ops, control, target):
+    """Swap the ``target = 0/1`` rows inside ``control = 1`` in place."""
+    B, dim, M = ops.shape
+    hi, lo = max(control, target), min(control, target)
+    view = ops.reshape(B, dim >> (hi + 1), 2, 1 << (hi - lo - 1), 2, (1 << lo) * M)
+    if control == hi:
+        a, b = view[:, :, 1, :, 0], view[:, :, 1, :, 1]
+    else:
+        a, b = view[:, :, 0, :, 1], view[:, :, 1, :, 1]
+    tmp = a.copy()
+    a[...] = b
+    b[...] = tmp
+    return ops
+
+
+def circuit_unitary(circuit):
+    """The unitary of a u3/cx ``Circuit``."""
+    return template_unitaries(circuit, None)[0]
+
+
+def template_unitaries(circuit, params):
+    """Unitaries of ``circuit`` with its u3 angles replaced batch-wise.
+
+    ``params`` has shape ``(B, n_u3, 3)`` (one row per u3 gate in order) or
+    is ``None`` to use the angles stored in the circuit.  All candidates
+    share the cx skeleton, so each gate is a single vectorized update.
+    """
+    u3s = [p for name, _, p in circuit.gates if name == 'u3']
+    if params is None:
+        params = np.array(u3s, dtype=float).reshape(1, len(u3s), 3)
+    params = np.asarray(params, dtype=float)
+    if params.shape[1:] != (len(u3s), 3):
+        raise ValueError('expected params of shape (B, %d, 3), got %s' % (len(u3s), params.shape))
+    mats = u3_matrices(params)
+    dim = 2 ** circuit.num_qubits
+    ops = np.broadcast_to(np.eye(dim, dtype=complex), (len(params), dim, dim)).copy()
+    k = 0
+    for name, qubits, _ in circuit.gates:
+        if name == 'u3':
+            apply_1q(ops, mats[:, k], qubits[0])
+            k += 1
+        else:
+            apply_cx(ops, *qubits)
+    return ops
+
+
+def batch_unitaries(circuits):
+    """Stack the unitaries of circuits that may have different skeletons."""
+    return np.stack([circuit_unitary(c) for c in circuits])
+
+
+def remove_global_phase(U, V):
+    """Rotate each ``V[b]`` by ``exp(-i arg tr(U^dag V[b]))``, the phase that
+    best aligns it with ``U``."""
+    overlap = np.einsum('ij,...ij->...', np.conj(U), V)
+    phase = np.where(np.abs(overlap) > 0, np.conj(overlap) / np.maximum(np.abs(overlap), 1e-300), 1.0)
+    return V * phase[..., None, None]
+
+
+def errors(U, V):
+    """Phase-invariant ``||U - V[b]||_2`` for a stack ``V`` of shape
+    ``(B, N, N)`` (a single ``(N, N)`` matrix gives a scalar)."""
+    U = np.asarray(U, dtype=complex)
+    V = np.asarray(V, dtype=complex)
+    diff = U - remove_global_phase(U, V)
+    return np.linalg.svd(diff, compute_uv=False)[..., 0]
+
+
+def costs(circuits):
+    return np.array([c.cost() for c in circuits])
+
+
+def score(U, circuits):
+    """``(errors, costs)`` arrays for a list of candidate circuits."""
+    return errors(U, batch_unitaries(circuits)), costs(circuits)
+
+
+def score_template(U, circuit, params):
+    """``(errors, cost)`` for a batch of angle sets on one cx skeleton; all
+    candidates share the same cost."""
+    return errors(U, template_unitaries(circuit, params)), circuit.cost()
+
+
+def check(U, circuit, eps=0.01):
+    """Like ``check_circuit``: ``(passed, error, cost)`` for one circuit."""
+    err = float(errors(U, circuit_unitary(circuit)))
+    return err <= eps, err, circuit.cost()